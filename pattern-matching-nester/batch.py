@@ -0,0 +1,127 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import contextlib
+from collections import Counter
+from dataclasses import asdict
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from nester import load_pattern, nester_from_args, add_nesting_arguments, marker_stats
+from nfp import engine_usage
+from parallel import make_executor
+
+SHARED_POOL_ATTEMPTS = 2  # a pattern that was unfinished this often when a shared pool died gets a pool of its own
+
+
+def collect_svg_files(source: str) -> list:
+    # a directory (all SVGs in it) or a manifest: one path per line, relative to the manifest, # starts a comment
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name) for name in os.listdir(source) if name.lower().endswith(".svg"))
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    svg_files = []
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                svg_files.append(os.path.join(base_dir, line))
+    return svg_files
+
+
+def nest_file(svg_file: str, args: argparse.Namespace) -> dict:
+    # runs in a worker, never raises: a broken pattern becomes an error result
+    result = {"file": svg_file}
+    usage_before = engine_usage.copy()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pattern = load_pattern(svg_file, merge_pieces=not args.no_merge)
+            loaded = time.perf_counter()
+            nester = nester_from_args(args, pattern=pattern)
+            placements = nester.fit_all(pattern.pieces)
+        nested = time.perf_counter()
+    except Exception as error:
+        result.update({
+            "status": "error",
+            "error": f"{type(error).__name__}: {error}",
+            "traceback": traceback.format_exc(),
+            "timings": {"total": round(time.perf_counter() - start, 3)},
+        })
+        return result
+
+    result.update({
+        "status": "ok",
+        "pieces": len(placements),
+        **marker_stats(placements, nester.fabric_vertices),
+        "timings": {"load": round(loaded - start, 3), "nest": round(nested - loaded, 3), "total": round(nested - start, 3)},
+        "nfp_engines": dict(engine_usage - usage_before),
+        "placements": [asdict(placement) for placement in placements],
+    })
+    return result
+
+
+def run_pool(svg_files: list, args: argparse.Namespace, jobs: int, write_result) -> list:
+    # nests the files on a fresh process pool, returns the ones it didn't finish because a worker died (OOM, segfault)
+    unfinished = []
+    with make_executor("process", jobs) as executor:
+        futures = {executor.submit(nest_file, svg_file, args): svg_file for svg_file in svg_files}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                unfinished.append(futures[future])  # the pattern that killed the worker, or one that was queued behind it
+                continue
+            write_result(result)
+    return unfinished
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Nest many SVG patterns in parallel, one JSON line per pattern as they finish.")
+    parser.add_argument("source", help="directory of SVGs or manifest file with one SVG path per line")
+    add_nesting_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=None, help="patterns nested at the same time (default: number of cores)")
+    parser.add_argument("--output", help="append the results to this JSONL file instead of printing them")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    svg_files = collect_svg_files(args.source)
+    failed = 0
+
+    output_file = open(args.output, "a") if args.output else sys.stdout
+
+    def write_result(result: dict) -> None:
+        nonlocal failed
+        failed += result["status"] != "ok"
+        output_file.write(json.dumps(result) + "\n")
+        output_file.flush()  # one line per pattern, as soon as it is done
+
+    try:
+        # a dead worker breaks the whole pool: what it didn't finish goes onto a fresh one, and patterns that keep being
+        # unfinished get nested alone, where a crash can only be their own
+        pending = svg_files
+        broken_pools = Counter()
+        while pending:
+            alone = [svg_file for svg_file in pending if broken_pools[svg_file] >= SHARED_POOL_ATTEMPTS]
+            shared = [svg_file for svg_file in pending if broken_pools[svg_file] < SHARED_POOL_ATTEMPTS]
+            for svg_file in alone:
+                if run_pool([svg_file], args, 1, write_result):
+                    write_result({"file": svg_file, "status": "error", "error": "BrokenProcessPool: the worker nesting this pattern died"})
+            pending = run_pool(shared, args, args.jobs, write_result) if shared else []
+            broken_pools.update(pending)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    print(f"{len(svg_files) - failed}/{len(svg_files)} patterns nested", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
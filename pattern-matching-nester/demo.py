@@ -2,20 +2,23 @@ import os
 import sys
 from PyQt5.QtWidgets import (
     QApplication, QGraphicsView, QGraphicsScene, QGraphicsPathItem, QPushButton,
-    QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QTextEdit, QGraphicsItem, QGraphicsEllipseItem
+    QMainWindow, QWidget, QHBoxLayout, QVBoxLayout, QGraphicsItem, QGraphicsEllipseItem
 )
 from PyQt5.QtGui import QPainterPath, QPen, QColor, QPainter
 from PyQt5.QtCore import Qt, QPointF
 
-from shapely import Polygon, LineString, MultiLineString, set_precision
+from shapely import Polygon
 from shapely.geometry import box
 
 from models.piece import Piece
-from models.pattern import Pattern
-from svg_helper import *
-from ifp import ifp
-from nfp import nfp
-from helper import INTERSECTION_PRECISION
+from svg_helper import parse_svg_metadata
+from nfp import engine_usage
+from nfp_cache import default_cache
+from nfp_store import NfpStore
+from parallel import make_executor
+from nfp_matrix import build_nfp_matrix
+from nester import Nester, load_pattern, generate_stripe_segments
+from helper import nfp_reference_point
 
 # "pattern profile"
 SVG_FILE = os.path.join(os.getcwd(), "data", "turtleneck_with_seams.svg")
@@ -26,6 +29,12 @@ ALLOWED_CLASS_LISTS = []
 fabric_vertices = [(0, 0), (200, 0), (200, 150), (0, 150)]
 stripe_spacing = 10
 FABRIC_STRIPE_SWITCH = True
+NFP_ENGINE = "orbital"  # or "decomposition" for concave pieces the orbit can't handle
+GEOMETRY_KERNEL = "float"  # or "fixed" for exact int64 grid arithmetic in nfp()/ifp() (needs the decomposition engine for concave pieces)
+NFP_EXECUTOR = None  # or "thread" / "process" to compute the NFPs against all placed pieces concurrently
+NFP_WORKERS = None  # defaults to the number of cores
+PRECOMPUTE_NFPS = False  # compute the NFPs of all piece pairs in a process pool before nesting starts
+NFP_STORE_PATH = None  # e.g. "nfp_store.bin" to keep NFPs across runs and share them between processes
 
 
 def vertices_to_qpainterpath(vertices: list) -> QPainterPath:
@@ -58,72 +67,6 @@ def bounding_box_from_polygon(poly_vertices: list) -> list:
     return list(bbox.exterior.coords)[:-1]  # cut off duplicate closing point
 
 
-def generate_stripe_segments(ifp: Polygon) -> list:
-    if ifp is None:
-        ifp = Polygon(fabric_vertices)
-
-    x_min, y_min, x_max, y_max = ifp.bounds
-
-     # Generate horizontal stripe lines
-    stripe_lines = [
-        LineString([(x_min, y), (x_max, y)])
-        for y in range(int(y_min), int(y_max) + 1, stripe_spacing)
-    ]
-
-    # Intersect each line with the IFP and flatten results
-    result = []
-    for line in stripe_lines:
-        intersection = ifp.intersection(line)
-        if not intersection.is_empty:
-            if isinstance(intersection, LineString):
-                result.append(intersection)
-            elif isinstance(intersection, MultiLineString):
-                result.extend(intersection.geoms)
-
-    return result
-
-
-def stretch_rectangle(rect: Polygon, offsets: tuple) -> Polygon:
-    """
-    Stretches an axis-aligned rectangle on the given axis.
-
-    Parameters:
-    - rect: A shapely Polygon representing a rectangle.
-    - offsets: amount to move the corresponding side (min_x, max_x, min_y, max_y).
-
-    Returns:
-    - A new Polygon with the stretched shape.
-    """
-    coords = list(rect.exterior.coords)[:-1]
-    minx, miny, maxx, maxy = rect.bounds
-    new_coords = []
-
-    for x, y in coords:
-        if x == maxx:
-            x += offsets[1]
-        if x == minx:
-            x -= offsets[0]
-        if y == maxy:
-            y += offsets[3]
-        if y == miny:
-            y -= offsets[2]
-        new_coords.append((x, y))
-    new_coords.append(new_coords[0])
-
-    return Polygon(new_coords)
-
-
-def simple_nfp(static_poly: Polygon, orbiting_poly: Polygon, reference_point: tuple) -> Polygon:
-    # assumption: 2 rectangles and reference point is on a corner
-    minx, miny, maxx, maxy = orbiting_poly.bounds
-    max_x_offset = reference_point[0] - minx  # the offset FOR max x
-    min_x_offset = maxx - reference_point[0]
-    max_y_offset = reference_point[1] - miny
-    min_y_offset = maxy - reference_point[1]
-    static_poly = stretch_rectangle(static_poly, (min_x_offset, max_x_offset, min_y_offset, max_y_offset))
-    return static_poly
-
-
 class PathItem(QGraphicsPathItem):
     def __init__(self, path: QPainterPath, attributes: dict, element=None, viewer=None):
         super().__init__(path)
@@ -179,6 +122,8 @@ class PolygonViewer(QMainWindow):
         super().__init__()
         self.pieces = pieces
         self.placed_pieces = []
+        self.nester = Nester(fabric_vertices, stripe_spacing, FABRIC_STRIPE_SWITCH, NFP_ENGINE, GEOMETRY_KERNEL, default_cache,
+                             make_executor(NFP_EXECUTOR, NFP_WORKERS))  # does the actual placing, the viewer only draws
         self.setWindowTitle("Interactive Algorithm Demo")
         self.setGeometry(100, 100, 800, 600)
         self.showMaximized()
@@ -234,7 +179,7 @@ class PolygonViewer(QMainWindow):
         }
         self.points_of_interest = []
 
-        self.fabric_texture = generate_stripe_segments(None) if FABRIC_STRIPE_SWITCH else None
+        self.fabric_texture = generate_stripe_segments(None, fabric_vertices, stripe_spacing) if FABRIC_STRIPE_SWITCH else None
         self.draw_everything()
 
     def fit_all(self) -> None:
@@ -242,11 +187,14 @@ class PolygonViewer(QMainWindow):
             self.advance_piece()
             self.show_ifp()
             self.fit_piece()
+        print(default_cache)
+        print("NFP engine usage:", dict(engine_usage))
+        print("piece shapes:", {piece.name: piece.shape_class() for piece in self.placed_pieces})
 
     def clear_ifp_nfp(self) -> None:
         self.__clear_ifp_nfp()
         if FABRIC_STRIPE_SWITCH:
-            self.fabric_texture = generate_stripe_segments(None)
+            self.fabric_texture = generate_stripe_segments(None, fabric_vertices, stripe_spacing)
         self.draw_everything()
 
     def __clear_ifp_nfp(self) -> None:
@@ -267,12 +215,12 @@ class PolygonViewer(QMainWindow):
         self.current_piece: Piece = self.pieces.pop(0)
         self.current_piece_vertices_draw = self.current_piece.vertices
         self.current_piece_vertices_calc = self.current_piece.vertices
-        self.points_of_interest = [min(self.current_piece.vertices, key=lambda v: (v[0], v[1]))]
+        self.points_of_interest = [nfp_reference_point(self.current_piece.vertices)]
 
         self.shapes[f"piece_{self.current_piece.index}"] = self.current_piece_vertices_draw
 
         if FABRIC_STRIPE_SWITCH:
-            self.fabric_texture = generate_stripe_segments(None)
+            self.fabric_texture = generate_stripe_segments(None, fabric_vertices, stripe_spacing)
         self.draw_everything()
 
     def draw_everything(self) -> None:
@@ -297,89 +245,51 @@ class PolygonViewer(QMainWindow):
         item = PathItem(texture_path, {"color": "#bbbbbb"}, viewer=self)
         self.scene.addItem(item)
 
-    def translate_current_piece(self, translation) -> None:
-        self.current_piece.vertices = [(x[0] + translation[0], x[1] + translation[1]) for x in self.current_piece.vertices]
+    def refresh_current_piece(self) -> None:
         self.current_piece_vertices_draw = self.current_piece.vertices
         self.current_piece_vertices_calc = self.current_piece.vertices
         self.shapes[f"piece_{self.current_piece.index}"] = self.current_piece_vertices_draw
-        self.points_of_interest = [min(self.current_piece.vertices, key=lambda v: (v[0], v[1]))]
+        self.points_of_interest = [nfp_reference_point(self.current_piece.vertices)]
 
     def show_ifp(self) -> None:
-        ifp_vertices = ifp(self.current_piece_vertices_calc, fabric_vertices)
+        ifp_vertices = self.nester.ifp_for(self.current_piece)
         if FABRIC_STRIPE_SWITCH:
-            self.fabric_texture = generate_stripe_segments(Polygon(ifp_vertices))
+            self.fabric_texture = generate_stripe_segments(Polygon(ifp_vertices), fabric_vertices, stripe_spacing)
         self.shapes["ifp"] = ifp_vertices
         self.shapes["ifp_color"] = "#FF0000"  # TODO rework this, the _color thing is a bit silly
         self.draw_everything()
 
-    def fit_first_piece(self) -> None:
-        reference_point = min(self.current_piece.vertices, key=lambda v: (v[0], v[1]))
-        ifp_vertices_sorted_by_appeal = list(sorted(self.shapes["ifp"]))
-        target_point = ifp_vertices_sorted_by_appeal[0]
-        translation = (target_point[0] - reference_point[0], target_point[1] - reference_point[1])
-        self.translate_current_piece(translation)
-        self.placed_pieces.append(self.current_piece)
-        self.draw_everything()
-
     def fit_piece(self) -> None:
-        if not self.placed_pieces:
-            self.fit_first_piece()
-            return
-
-        reference_point_piece = min(self.current_piece_vertices_calc, key=lambda v: (v[0], v[1]))
-        main_polygon = Polygon(self.shapes["ifp"])
-        polygons_to_subtract = [Polygon(x.vertices) for x in self.placed_pieces]
-
-        result = main_polygon
-        for index, poly in enumerate(polygons_to_subtract):
-            nfp_poly = nfp(poly, Polygon(self.current_piece_vertices_calc), reference_point_piece)
-            self.shapes[f"nfp_{index}"] = list(nfp_poly.exterior.coords)
-            self.shapes[f"nfp_{index}_color"] = "#0000FF"
-            result_imprecise = result.difference(nfp_poly)
-            result = set_precision(result_imprecise, INTERSECTION_PRECISION)
-
-        if FABRIC_STRIPE_SWITCH:
-            self.fabric_texture = generate_stripe_segments(result)
-            target_point = min(
-                (pt for line in self.fabric_texture for pt in line.coords),
-                key=lambda p: (p[0], p[1])
-            )
-        else:  # just use IFP corner
-            coords = list(result.exterior.coords)[:-1]
-            target_point = min(coords, key=lambda p: (p[0], p[1]))
-
-        translation = (target_point[0] - reference_point_piece[0], target_point[1] - reference_point_piece[1])
-        self.translate_current_piece(translation)
+        self.nester.place(self.current_piece, self.shapes["ifp"])
+        feasible_region = self.nester.last_region
+        if feasible_region is not None:  # None for the first piece, that one just goes into the IFP's corner
+            print(feasible_region)
+            for index, nfp_poly in enumerate(feasible_region.nfps):
+                self.shapes[f"nfp_{index}"] = list(nfp_poly.exterior.coords)
+                self.shapes[f"nfp_{index}_color"] = "#0000FF"
+            if FABRIC_STRIPE_SWITCH:
+                self.fabric_texture = generate_stripe_segments(feasible_region.region, fabric_vertices, stripe_spacing)
+
+        self.refresh_current_piece()
         self.placed_pieces.append(self.current_piece)
         self.draw_everything()
 
 if __name__ == '__main__':
-    if not os.path.exists(SVG_FILE):
-            raise FileNotFoundError(f"SVG file not found: {SVG_FILE}")
-
-    svg_attributes = get_svg_attributes(SVG_FILE)
-    height = svg_attributes.get("height")
-    unit_scale = 0.1 if "mm" in height else 1
-
-    paths = load_selected_paths(SVG_FILE)
-
-    pieces = []
-    for index, path_tuple in enumerate(paths):
-        name, path = path_tuple
-        piece = Piece(index, name, path, unit_scale)
-        pieces.append(piece)
-
-    seams = parse_svg_metadata(SVG_FILE)
-    for seam in seams:
+    full_pattern = load_pattern(SVG_FILE, MERGE_PIECES, MERGE_SLEEVES, ALLOWED_CLASS_LISTS)
+    for seam in parse_svg_metadata(SVG_FILE):  # as they are in the file, the pattern only keeps the ones between merged pieces
         print(f"Seam ID: {seam.id}")
         for part in seam.seamparts:
             print(f"  Part: {part.part}, Start: {part.start}, End: {part.end}")
-
-    merged_pieces = reindex(merge_pieces_with_common_vertices(pieces, unit_scale)) if MERGE_PIECES else pieces
-    merged_pieces.sort(key=lambda p: p.area(), reverse=True)
-    reduced_seams = reduce_seams(merged_pieces, seams) if MERGE_PIECES else seams
-
-    full_pattern = Pattern(merged_pieces, reduced_seams)
+    merged_pieces = full_pattern.pieces
+
+    if NFP_STORE_PATH:
+        default_cache.store = NfpStore(NFP_STORE_PATH)
+    if PRECOMPUTE_NFPS:
+        nfp_matrix = build_nfp_matrix(full_pattern.pieces, engine=NFP_ENGINE, kernel=GEOMETRY_KERNEL, workers=NFP_WORKERS)
+        print(nfp_matrix)
+        for pair, error in nfp_matrix.failures.items():
+            print(f"NFP {pair} failed, it will be computed while nesting instead: {error}")
+        nfp_matrix.fill_cache(default_cache)
 
     app = QApplication(sys.argv)
     viewer = PolygonViewer(merged_pieces)
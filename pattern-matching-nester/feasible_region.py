@@ -0,0 +1,64 @@
+import hashlib
+
+import numpy as np
+
+from shapely import set_precision, union_all, prepare, intersects_xy, box, STRtree
+from shapely.geometry import Polygon
+
+from helper import INTERSECTION_PRECISION
+from nfp_cache import local_frame
+
+
+def shape_key(polygon: Polygon, rotation: float = 0) -> str:
+    # same shape (wherever it currently is) and rotation -> same feasible region
+    local_coords, _ = local_frame(polygon)
+    return hashlib.blake2b(local_coords.tobytes() + f"|{rotation}".encode(), digest_size=16).hexdigest()
+
+
+class FeasibleRegion():
+    """
+    Where the reference point of one piece shape (in one rotation) can still go: its IFP minus the NFPs of all placed pieces.
+    - placed pieces are only subtracted when the region is needed again, and each one only once
+    - placed pieces whose NFP can't reach the region anymore are skipped, their NFPs are never computed
+    - the placed pieces list is expected to only ever grow (pieces don't get unplaced)
+    """
+    def __init__(self, ifp_poly: Polygon, piece_poly: Polygon):
+        self.region = ifp_poly
+        min_x, min_y, max_x, max_y = piece_poly.bounds
+        self.piece_size = (max_x - min_x, max_y - min_y)
+        self.nfps = []  # everything subtracted so far, in placing order
+        self.considered = 0  # number of placed pieces already subtracted or skipped
+        self.skipped = 0
+        prepare(self.region)
+
+    def __str__(self):
+        return f"Feasible region: {len(self.nfps)} NFPs subtracted, {self.skipped} skipped, area {self.region.area:.2f}"
+
+    def nfp_bounds(self, placed_poly: Polygon) -> Polygon:
+        # the NFP tracks a vertex of the piece, so it can't stick out of the placed piece's bbox by more than the piece's size
+        width, height = self.piece_size
+        min_x, min_y, max_x, max_y = placed_poly.bounds
+        return box(min_x - width, min_y - height, max_x + width, max_y + height)
+
+    def update(self, placed_polys: list, nfp_function) -> Polygon:
+        # nfp_function(list of newly placed polygons) -> their NFPs
+        pending = placed_polys[self.considered:]
+        self.considered = len(placed_polys)
+        if not pending:
+            return self.region
+
+        # the region only ever shrinks, so a piece that can't reach it now never will
+        tree = STRtree([self.nfp_bounds(placed_poly) for placed_poly in pending])
+        reachable = sorted(tree.query(self.region, predicate="intersects"))
+        self.skipped += len(pending) - len(reachable)
+        if reachable:
+            new_nfps = nfp_function([pending[index] for index in reachable])
+            self.region = set_precision(self.region.difference(union_all(new_nfps)), INTERSECTION_PRECISION)
+            self.nfps.extend(new_nfps)
+            prepare(self.region)
+        return self.region
+
+    def contains(self, points) -> np.ndarray:
+        # points on the border are fine, that's where the piece touches its neighbours
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        return intersects_xy(self.region, points[:, 0], points[:, 1])
@@ -0,0 +1,173 @@
+import numpy as np
+
+from shapely import union_all, transform
+from shapely.geometry import Polygon
+
+from helper import GRID_SCALE, LEFT, PARALLEL, RIGHT, EdgePair, feasibility_from_coords
+from minkowski import ccw_vertices, cached_convex_decomposition
+
+# integer fixed-point kernel: coordinates are quantized once to int64 units of INTERSECTION_PRECISION,
+# after that orientation, intersection and equality tests are exact and nothing has to be snapped again
+UNITS_PER_CM = GRID_SCALE
+
+
+def quantize(coords) -> np.ndarray:
+    # same rounding as helper.snap() / set_precision, so both kernels agree on where a point is
+    return np.floor(np.asarray(coords, dtype=float) * UNITS_PER_CM + 0.5).astype(np.int64)
+
+
+def dequantize(units: np.ndarray) -> np.ndarray:
+    return np.asarray(units, dtype=float) / UNITS_PER_CM
+
+
+def orientation(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    # sign of the turn a -> b -> c: 1 left, -1 right, 0 collinear. broadcasts over leading dimensions
+    cross = (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+    return np.sign(cross)
+
+
+def points_equal(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    return np.all(p == q, axis=-1)
+
+
+def fixed_classify_edge_pair(units: np.ndarray) -> int:
+    # same cases as helper.classify_edge_pair(), units: a start, a end, b start, b end, shared point (see EdgePair.units).
+    # decided by which endpoints the shared point is: both edges run through it (see OrbitPolygon.incident_edges), but it
+    # was found by trimming the move, so an exact "does it lie on the edge" test would throw away contacts a fraction
+    # of a unit off
+    a_start, a_end, b_start, b_end, shared = (tuple(point) for point in units.tolist())
+    endpoints_a = {a_start, a_end}
+    endpoints_b = {b_start, b_end}
+
+    common_endpoint = endpoints_a & endpoints_b
+    if common_endpoint:
+        if len(common_endpoint) == 2:
+            return 1
+        endpoint = common_endpoint.pop()
+        if endpoint == shared:
+            return 1
+        return 2 if endpoint in endpoints_b else 3
+
+    if shared in endpoints_b:
+        return 2  # B's vertex on the middle of A
+    if shared in endpoints_a:
+        return 3  # A's vertex on the middle of B
+    # the middles touch: crossing edges count like B's vertex on A, overlapping ones like A's vertex on B
+    return 3 if np.all(orientation(units[0], units[1], units[2:4]) == 0) else 2
+
+
+def fixed_is_left_or_right(pair: EdgePair) -> str:
+    # same answer as helper.is_left_or_right(), but collinear means exactly collinear instead of within half a degree
+    side = fixed_sides(*pair.units[:4])
+    return "left" if side == LEFT else "right" if side == RIGHT else "parallel"
+
+
+def fixed_sides(edge_starts: np.ndarray, edge_ends: np.ndarray, other_starts: np.ndarray, other_ends: np.ndarray) -> np.ndarray:
+    # helper.sides() on grid units (..., 2) that broadcast against each other, LEFT / PARALLEL / RIGHT are the signs orientation() gives
+    identical = (points_equal(edge_starts, other_starts) & points_equal(edge_ends, other_ends)) \
+        | (points_equal(edge_starts, other_ends) & points_equal(edge_ends, other_starts))
+
+    # the end of the other edge that doesn't touch the edge, or the one further from its start if neither does
+    start_touches = points_equal(other_starts, edge_starts) | points_equal(other_starts, edge_ends)
+    end_touches = points_equal(other_ends, edge_starts) | points_equal(other_ends, edge_ends)
+    start_is_farther = np.sum((other_starts - edge_starts) ** 2, axis=-1) > np.sum((other_ends - edge_starts) ** 2, axis=-1)
+    use_start = np.where(start_touches | end_touches, ~start_touches, start_is_farther)
+    point = np.where(use_start[..., None], other_starts, other_ends)
+    return np.where(identical, PARALLEL, orientation(edge_starts, edge_ends, point))
+
+
+def fixed_feasibility_matrix(translation_vectors: list, pairs: list) -> np.ndarray:
+    # helper.feasibility_matrix() on the pairs' grid units, the candidate vectors are differences of grid points already
+    units = np.array([pair.units for pair in pairs], dtype=np.int64).reshape(-1, 5, 2)
+    edge_cases = np.array([pair.edge_case for pair in pairs])
+    return feasibility_from_coords(quantize(translation_vectors).reshape(-1, 2), units[:, 4], units[:, 0:2], units[:, 2:4], edge_cases,
+                                   side_test=fixed_sides, min_length=1)
+
+
+def ccw_units(polygon: Polygon) -> np.ndarray:
+    units = quantize(ccw_vertices(polygon))
+    return units[~points_equal(units, np.roll(units, -1, axis=0))]  # quantizing can make neighbours equal
+
+
+def is_convex_units(units: np.ndarray) -> bool:
+    if len(units) < 3:
+        return False
+    return bool(np.all(orientation(units, np.roll(units, -1, axis=0), np.roll(units, -2, axis=0)) >= 0))
+
+
+def __lower_half(x: int, y: int) -> bool:
+    # angles in [pi, 2pi), cross products only order directions within the same half turn
+    return y < 0 or (y == 0 and x < 0)
+
+
+def minkowski_sum_convex_units(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    # like minkowski.minkowski_sum_convex(), but the edges are merged by exact cross products instead of sorted by angle
+    p = np.roll(p, -np.lexsort((p[:, 0], p[:, 1]))[0], axis=0)
+    q = np.roll(q, -np.lexsort((q[:, 0], q[:, 1]))[0], axis=0)
+    p_edges = (np.roll(p, -1, axis=0) - p).tolist()
+    q_edges = (np.roll(q, -1, axis=0) - q).tolist()
+
+    merged_edges = []
+    i = j = 0
+    while i < len(p_edges) or j < len(q_edges):
+        if j == len(q_edges):
+            take_p = True
+        elif i == len(p_edges):
+            take_p = False
+        else:
+            (px, py), (qx, qy) = p_edges[i], q_edges[j]
+            p_half, q_half = __lower_half(px, py), __lower_half(qx, qy)
+            # p's edge doesn't point further round than q's (python ints, can't overflow)
+            take_p = p_half < q_half or (p_half == q_half and px * qy - py * qx >= 0)
+        if take_p:
+            merged_edges.append(p_edges[i])
+            i += 1
+        else:
+            merged_edges.append(q_edges[j])
+            j += 1
+
+    start = p[0] + q[0]
+    return start + np.concatenate(([(0, 0)], np.cumsum(np.asarray(merged_edges, dtype=np.int64), axis=0)[:-1]))
+
+
+def convex_pair_nfp_units(a_units: np.ndarray, b_units: np.ndarray, reference_units: np.ndarray) -> np.ndarray:
+    return minkowski_sum_convex_units(a_units, -b_units) + reference_units
+
+
+def __to_polygon(units_geometry) -> Polygon:
+    return transform(units_geometry, dequantize)
+
+
+def fixed_convex_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
+    # same contract as minkowski.convex_nfp()
+    pt_b_ymax = quantize(max(b_poly_untranslated.exterior.coords, key=lambda p: p[1]))
+    nfp_units = convex_pair_nfp_units(ccw_units(a_poly_raw), ccw_units(b_poly_untranslated), pt_b_ymax)
+    return Polygon(dequantize(nfp_units))
+
+
+def fixed_decomposition_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
+    # same contract as minkowski.decomposition_nfp(), the parts are decomposed on the quantized pieces
+    pt_b_ymax = quantize(max(b_poly_untranslated.exterior.coords, key=lambda p: p[1]))
+    a_parts = [part.astype(np.int64) for part in cached_convex_decomposition(Polygon(quantize(a_poly_raw.exterior.coords)))]
+    b_parts = [part.astype(np.int64) for part in cached_convex_decomposition(Polygon(quantize(b_poly_untranslated.exterior.coords)))]
+
+    part_nfps = [Polygon(convex_pair_nfp_units(a_part, b_part, pt_b_ymax)) for a_part in a_parts for b_part in b_parts]
+    return __to_polygon(union_all(part_nfps, grid_size=1))  # the union's own intersection points land on the grid too
+
+
+def fixed_ifp(input_points: list, fabric_vertices: list) -> list:
+    # same as ifp.ifp(), but without accumulating float error in the subtractions
+    units = quantize(input_points)
+    reference_point = units[np.argmax(units[:, 1])]  # like helper.nfp_reference_point, the first highest vertex
+    min_x, min_y = units.min(axis=0)
+    max_x, max_y = units.max(axis=0)
+    fabric_units = quantize(fabric_vertices)
+    fabric_min_x, fabric_min_y = fabric_units.min(axis=0)
+    fabric_max_x, fabric_max_y = fabric_units.max(axis=0)
+
+    ifp_min_x = fabric_min_x + reference_point[0] - min_x
+    ifp_max_x = fabric_max_x - (max_x - reference_point[0])
+    ifp_min_y = fabric_min_y + reference_point[1] - min_y
+    ifp_max_y = fabric_max_y - (max_y - reference_point[1])
+    ifp_units = np.array([(ifp_min_x, ifp_min_y), (ifp_max_x, ifp_min_y), (ifp_max_x, ifp_max_y), (ifp_min_x, ifp_max_y)])
+    return [tuple(point) for point in dequantize(ifp_units).tolist()]
@@ -0,0 +1,190 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import tempfile
+import argparse
+import contextlib
+from dataclasses import dataclass, field, asdict
+
+from models.piece import Piece
+from nester import Nester, marker_stats, load_pattern, add_nesting_arguments, nester_options
+from nfp_cache import default_cache
+from nfp_store import NfpStore
+from orientation import IDENTITY, allowed_orientations
+from parallel import make_executor
+
+POPULATION_SIZE = 20
+TOURNAMENT_SIZE = 3
+MUTATION_RATE = 0.2  # per individual, one swap or one orientation change
+ELITE_COUNT = 2  # best individuals that go into the next generation unchanged
+
+
+@dataclass
+class SearchResult:
+    order: tuple  # positions in the input pieces list, in placing order
+    orientations: tuple  # (rotation, mirrored) per input piece, see orientation.py
+    used_length: float
+    placements: list
+    generations: int = 0
+    evaluations: int = 0
+    history: list = field(default_factory=list)  # best used length after each generation
+
+
+# ----- worker side -----
+
+__worker_pieces = []
+__worker_nester_options = {}
+
+
+def init_worker(pieces_data: list, nester_options: dict, store_path: str | None) -> None:
+    # every worker keeps its own in-memory NFP cache across evaluations, the store shares NFPs between workers
+    global __worker_pieces, __worker_nester_options
+    __worker_pieces = pieces_data
+    __worker_nester_options = nester_options
+    if store_path:
+        default_cache.store = NfpStore(store_path)
+
+
+def evaluate(order: tuple, orientations: tuple) -> tuple:
+    # bottom-left placement of one candidate: (used length, placements), infinitely long if it doesn't fit
+    # the Nester turns every piece into its one allowed orientation, NFPs against turned pieces are derived (nfp.oriented_nfps)
+    pieces = []
+    for position in order:
+        index, name, vertices = __worker_pieces[position]
+        pieces.append(Piece.from_vertices(index, name, vertices))
+        pieces[-1].orientations = [orientations[position]]
+    # seam phases are worked out for the pieces as they are, turned pieces lose theirs
+    unturned = set(__worker_pieces[position][0] for position in order if orientations[position] == IDENTITY)
+    options = dict(__worker_nester_options)
+    for key in ("stripe_phases", "lattice_phases"):
+        options[key] = {index: phase for index, phase in (options.get(key) or {}).items() if index in unturned}
+    nester = Nester(**options)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            placements = nester.fit_all(pieces)
+    except Exception:
+        return math.inf, []
+    return marker_stats(placements, nester.fabric_vertices)["used_length"], placements
+
+
+# ----- search -----
+
+def order_crossover(parent_a: tuple, parent_b: tuple, rng: random.Random) -> tuple:
+    # OX1: a slice of parent a stays where it is, the rest is filled up in parent b's order
+    start, end = sorted(rng.sample(range(len(parent_a) + 1), 2))
+    kept = parent_a[start:end]
+    rest = [position for position in parent_b if position not in kept]
+    return tuple(rest[:start]) + kept + tuple(rest[start:])
+
+
+def mutate(order: tuple, orientations: tuple, allowed: tuple, rng: random.Random) -> tuple:
+    order, orientations = list(order), list(orientations)
+    if len(allowed) > 1 and rng.random() < 0.5:
+        position = rng.randrange(len(orientations))
+        orientations[position] = rng.choice(allowed)
+    elif len(order) > 1:
+        i, j = rng.sample(range(len(order)), 2)
+        order[i], order[j] = order[j], order[i]
+    return tuple(order), tuple(orientations)
+
+
+def genetic_search(pieces: list, nester_options: dict = None, allowed: tuple = (IDENTITY,), population_size: int = POPULATION_SIZE,
+                   generations: int = 20, time_budget: float = None, workers: int = None, seed: int = None, store_path: str = None) -> SearchResult:
+    """
+    Searches piece order and orientations (allowed: (rotation, mirrored) pairs) for the shortest bottom-left marker.
+    - candidates are evaluated in a process pool, each worker runs the normal Nester with its own NFP cache
+    - the workers share NFPs through an NfpStore (a temporary one unless store_path is given), since the same pairs keep coming up
+    - stops after the given number of generations or once time_budget (seconds) is used up, whatever comes first
+    The input order (biggest pieces first, usually) is part of the first generation, so the result is never worse than that.
+    """
+    rng = random.Random(seed)
+    nester_options = nester_options or {}
+    pieces_data = [(piece.index, piece.name, list(piece.vertices)) for piece in pieces]
+    deadline = time.monotonic() + time_budget if time_budget else math.inf
+    n = len(pieces)
+
+    population = [(tuple(range(n)), (IDENTITY if IDENTITY in allowed else allowed[0],) * n)]
+    while len(population) < population_size:
+        population.append((tuple(rng.sample(range(n), n)), tuple(rng.choice(allowed) for _ in range(n))))
+
+    fitness = {}  # (order, orientations) -> (used length, placements), candidates are never evaluated twice
+    result = SearchResult((), (), math.inf, [])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = store_path or os.path.join(temp_dir, "nfp_store.bin")
+        with make_executor("process", workers, init_worker, (pieces_data, nester_options, store_path)) as executor:
+            for generation in range(generations):
+                new_candidates = list(dict.fromkeys(candidate for candidate in population if candidate not in fitness))
+                futures = [executor.submit(evaluate, *candidate) for candidate in new_candidates]
+                for candidate, future in zip(new_candidates, futures):
+                    fitness[candidate] = future.result()
+                result.evaluations = len(fitness)
+                result.generations = generation + 1
+
+                population.sort(key=lambda candidate: fitness[candidate][0])
+                best = population[0]
+                if fitness[best][0] < result.used_length:
+                    result.order, result.orientations = best
+                    result.used_length, result.placements = fitness[best]
+                result.history.append(result.used_length)
+                if time.monotonic() >= deadline or generation == generations - 1:
+                    break
+
+                next_population = population[:ELITE_COUNT]
+                while len(next_population) < population_size:
+                    parent_a = min(rng.sample(population, TOURNAMENT_SIZE), key=lambda candidate: fitness[candidate][0])
+                    parent_b = min(rng.sample(population, TOURNAMENT_SIZE), key=lambda candidate: fitness[candidate][0])
+                    order = order_crossover(parent_a[0], parent_b[0], rng)
+                    orientations = tuple(rng.choice((a, b)) for a, b in zip(parent_a[1], parent_b[1]))
+                    if rng.random() < MUTATION_RATE:
+                        order, orientations = mutate(order, orientations, allowed, rng)
+                    next_population.append((order, orientations))
+                population = next_population
+    return result
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Search piece order and orientations for a shorter marker, in a process pool.")
+    parser.add_argument("svg_file")
+    add_nesting_arguments(parser)
+    parser.add_argument("--rotations", type=float, nargs="+", default=[0], help="allowed piece rotations (degrees)")
+    parser.add_argument("--mirror", action="store_true", help="pieces may also be cut mirrored")
+    parser.add_argument("--population", type=int, default=POPULATION_SIZE)
+    parser.add_argument("--generations", type=int, default=20)
+    parser.add_argument("--time-budget", type=float, default=None, help="stop after this many seconds (checked after each generation)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--store", help="NFP store shared by the workers, kept after the search (default: a temporary one)")
+    parser.add_argument("--output", help="write the best placements to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern = load_pattern(args.svg_file, merge_pieces=not args.no_merge)
+    options = nester_options(args, pattern)
+    start = time.perf_counter()
+    result = genetic_search(pattern.pieces, options, tuple(allowed_orientations(args.rotations, args.mirror)), args.population, args.generations,
+                            args.time_budget, args.workers, args.seed, args.store)
+
+    print(f"{result.evaluations} layouts evaluated in {result.generations} generations ({time.perf_counter() - start:.1f}s)")
+    print("best used length per generation:", result.history)
+    if not result.placements:
+        print("No layout fits on the fabric")
+        return 1
+    for placement in result.placements:
+        mirrored = ", mirrored" if placement.mirrored else ""
+        print(f"{placement.name}: rotated by {placement.rotation}{mirrored}, translated by ({placement.translation[0]:.2f}, {placement.translation[1]:.2f})")
+    print(marker_stats(result.placements, options["fabric_vertices"]))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump([asdict(placement) for placement in result.placements], output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
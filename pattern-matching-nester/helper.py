@@ -1,12 +1,21 @@
 import math
 from dataclasses import dataclass
 
+import numpy as np
+
 from shapely import set_precision, line_merge
-from shapely.geometry import Polygon, Point, LineString, MultiLineString
-from shapely.ops import nearest_points
+from shapely.geometry import Point, LineString
 
 INTERSECTION_PRECISION = 0.01
 NO_OF_ROUNDING_DIGITS = 2
+GRID_SCALE = round(1 / INTERSECTION_PRECISION)
+SNAP_TOLERANCE = INTERSECTION_PRECISION / 2
+PARALLEL_ANGLE = 0.5  # degrees, see is_left_or_right()
+
+def nfp_reference_point(vertices) -> tuple:
+    # the vertex every NFP engine tracks (pt_b_ymax, the first one with the highest y), so it's also the one that gets placed
+    return tuple(max(vertices, key=lambda p: p[1]))
+
 
 @dataclass
 class EdgePair:
@@ -16,6 +25,7 @@ class EdgePair:
     edge_b_index: int
     shared_vertex: Point
     edge_case: int
+    units: np.ndarray = None  # fixed-point kernel only: a start, a end, b start, b end, shared vertex as int64 grid units
 
 
 def handle_intersection(intersection):
@@ -60,16 +70,6 @@ def handle_intersection(intersection):
     return shared_points, line_intersection_flag, linestring_intersection_length
 
 
-def incident_edges(polygon: Polygon, point: Point) -> list:
-    coords = list(polygon.exterior.coords)
-    edges = []
-    for i in range(len(coords) - 1):  # skip closing segment
-        edge = LineString([coords[i], coords[i + 1]])
-        if edge.distance(point) <= INTERSECTION_PRECISION:  # Point-Edge intersection is too flaky, unfortunately
-            edges.append(edge)
-    return edges
-
-
 def classify_edge_pair(edge_pair: tuple, shared_point: Point) -> int:
     precise_edge_a = set_precision(edge_pair[0], INTERSECTION_PRECISION)
     precise_edge_b = set_precision(edge_pair[1], INTERSECTION_PRECISION)
@@ -102,13 +102,14 @@ def classify_edge_pair(edge_pair: tuple, shared_point: Point) -> int:
     return 0
 
 
-def translation_vector_from_edge_pair(pair: EdgePair) -> tuple:
+def translation_vector_from_edge_pair(pair: EdgePair, side_test=None) -> tuple:
+    # side_test(pair): replaces is_left_or_right(), the fixed-point kernel decides on the pair's grid units
     # 1. find out whether the touching vertex is start of end of a/b
     edge_a_part = "start" if set_precision(Point(pair.edge_a.coords[0]), INTERSECTION_PRECISION) == pair.shared_vertex else "end"
     edge_b_part = "start" if set_precision(Point(pair.edge_b.coords[0]), INTERSECTION_PRECISION) == pair.shared_vertex else "end"
 
     # 2. find out if edge b is left or right (or parallel) of edge a
-    relative_position = is_left_or_right(pair.edge_a, pair.edge_b)
+    relative_position = side_test(pair) if side_test is not None else is_left_or_right(pair.edge_a, pair.edge_b)
 
     # 3. get case and return translation vector (or None, that's fine too)
     match(get_edge_case(edge_a_part, edge_b_part, relative_position)):
@@ -178,151 +179,175 @@ def get_edge_case(edge_a_part: str, edge_b_part: str, relative_position: str) ->
     return 0
 
 
-def is_in_feasible_range(translation_vector: tuple, pair: EdgePair) -> bool:
-    shared_vertex = (pair.shared_vertex.x, pair.shared_vertex.y)
-    translation_vector_endpoint = (pair.shared_vertex.x + translation_vector[0], pair.shared_vertex.y + translation_vector[1])
-    translation_vector_linestring = LineString([shared_vertex, translation_vector_endpoint])
-
-    match pair.edge_case:
-        case 1:
-            # the allowed range is the side of a that b is on, union with the side of b that a is not on
-            # borders (="parallel") are allowed too
-            if pair.edge_a_index == 3:
-                pass
-            allowed_side_a = is_left_or_right(pair.edge_a, pair.edge_b)
-            allowed_side_b = is_left_or_right(pair.edge_b, pair.edge_a)
-            location_a = is_left_or_right(pair.edge_a, translation_vector_linestring)
-            location_b = is_left_or_right(pair.edge_b, translation_vector_linestring)
-            if allowed_side_a == "parallel" and allowed_side_b == "parallel":
-                return True
-
-            negated_side_b = "right" if allowed_side_b == "left" else "left"
-            return location_a in [allowed_side_a, "parallel"] or location_b in [negated_side_b, "parallel"]
-        case 2:
-            # side of a that b is on, but only use the part of a betweeen shared_vertex and its end
-            trimmed_a = LineString([shared_vertex, (pair.edge_a.coords[1])])
-            if trimmed_a.length < INTERSECTION_PRECISION:
-                return True
-
-            allowed_side_a = is_left_or_right(trimmed_a, pair.edge_b)
-            if allowed_side_a == "parallel":  # in cases 2 and 3 that means the two edges are laying on top of each other
-                return True
-
-            location_a = is_left_or_right(trimmed_a, translation_vector_linestring)
-            return location_a in [allowed_side_a, "parallel"]
-        case 3:
-            # side of b that a is not on, but only use the part of b betweeen shared_vertex and its end
-            trimmed_b = LineString([shared_vertex, (pair.edge_b.coords[1])])
-            if trimmed_b.length < INTERSECTION_PRECISION:
-                return True
-
-            disallowed_side_b = is_left_or_right(trimmed_b, pair.edge_a)
-            if disallowed_side_b == "parallel":
-                return True
-
-            location_b = is_left_or_right(trimmed_b, translation_vector_linestring)
-            return location_b != disallowed_side_b
-
-
-def trim_translation_vector(source_poly: Polygon, target_poly: Polygon, translation_vector: tuple, shared_vertices: list, known_intersection, reverse: bool = False) -> tuple:
+LEFT, PARALLEL, RIGHT = 1, 0, -1
+
+
+def sides(edge_starts: np.ndarray, edge_ends: np.ndarray, other_starts: np.ndarray, other_ends: np.ndarray) -> np.ndarray:
+    # vectorized is_left_or_right(), on (..., 2) arrays that broadcast against each other. returns LEFT / PARALLEL / RIGHT
+    edge_starts, edge_ends, other_starts, other_ends = (snap(np.asarray(coords, dtype=float)) for coords in (edge_starts, edge_ends, other_starts, other_ends))
+    identical = (np.all(edge_starts == other_starts, axis=-1) & np.all(edge_ends == other_ends, axis=-1)) \
+        | (np.all(edge_starts == other_ends, axis=-1) & np.all(edge_ends == other_starts, axis=-1))
+
+    # the point that is compared against the edge: the end of the other edge that doesn't touch it
+    def touches(point):
+        return (np.hypot(*np.moveaxis(point - edge_starts, -1, 0)) < 1e-6) | (np.hypot(*np.moveaxis(point - edge_ends, -1, 0)) < 1e-6)
+    start_touches, end_touches = touches(other_starts), touches(other_ends)
+    start_is_farther = np.hypot(*np.moveaxis(other_starts - edge_starts, -1, 0)) > np.hypot(*np.moveaxis(other_ends - edge_starts, -1, 0))
+    use_start = np.where(start_touches | end_touches, ~start_touches, start_is_farther)
+    point = np.where(use_start[..., None], other_starts, other_ends)
+
+    to_point = np.round(point - edge_starts, NO_OF_ROUNDING_DIGITS)
+    along_edge = np.round(edge_ends - edge_starts, NO_OF_ROUNDING_DIGITS)
+    cross_product = cross(to_point, along_edge)
+    dot_product = np.einsum("...i,...i->...", to_point, along_edge)
+
+    # angle > 180 -> left, 180 or below PARALLEL_ANGLE -> parallel, anything else -> right
+    # the cross product gets a tolerance, the inputs are on the grid but their products carry float noise
+    result = np.where(cross_product < 0, LEFT, RIGHT)
+    result = np.where(np.abs(cross_product) <= INTERSECTION_PRECISION ** 4, PARALLEL, result)
+    result = np.where((cross_product > 0) & (cross_product <= dot_product * math.tan(math.radians(PARALLEL_ANGLE))), PARALLEL, result)
+    return np.where(identical, PARALLEL, result)
+
+
+def feasibility_matrix(translation_vectors: list, pairs: list) -> np.ndarray:
+    """
+    Which translation vectors stay within the feasible range of which touching edge pair, as a (vectors, pairs) boolean matrix.
+    - case 1: the side of a that b is on, union with the side of b that a is not on (borders are allowed too)
+    - case 2: the side of a that b is on, using only the part of a between the shared vertex and its end
+    - case 3: the side of b that a is not on, using only the part of b between the shared vertex and its end
+    A vector is feasible if its whole row is True.
+    """
+    shared = np.array([(pair.shared_vertex.x, pair.shared_vertex.y) for pair in pairs], dtype=float)
+    a = np.array([pair.edge_a.coords for pair in pairs], dtype=float)
+    b = np.array([pair.edge_b.coords for pair in pairs], dtype=float)
+    edge_cases = np.array([pair.edge_case for pair in pairs])
+    return feasibility_from_coords(np.asarray(translation_vectors, dtype=float), shared, a, b, edge_cases)
+
+
+def feasibility_from_coords(translation_vectors: np.ndarray, shared: np.ndarray, a: np.ndarray, b: np.ndarray, edge_cases: np.ndarray,
+                            side_test=sides, min_length: float = INTERSECTION_PRECISION) -> np.ndarray:
+    # feasibility_matrix() on arrays: shared (pairs, 2), a / b (pairs, 2, 2). the fixed-point kernel passes grid units,
+    # its own exact side test and a minimum length of one unit
+    if not np.isin(edge_cases, (1, 2, 3)).all():
+        raise Exception("Invalid edge case")
+    vector_ends = shared[None, :, :] + translation_vectors.reshape(-1, 1, 2)
+
+    # the edge whose side is checked first: a (case 1), a from the shared vertex on (case 2), b from the shared vertex on (case 3)
+    first_starts = np.where((edge_cases == 1)[:, None], a[:, 0], shared)
+    first_ends = np.where((edge_cases == 3)[:, None], b[:, 1], a[:, 1])
+    first_others = np.where((edge_cases == 3)[:, None, None], a, b)
+    allowed_first = side_test(first_starts, first_ends, first_others[:, 0], first_others[:, 1])
+    location_first = side_test(first_starts, first_ends, shared, vector_ends)
+
+    allowed_b = side_test(b[:, 0], b[:, 1], a[:, 0], a[:, 1])
+    location_b = side_test(b[:, 0], b[:, 1], shared, vector_ends)
+    negated_side_b = np.where(allowed_b == LEFT, RIGHT, LEFT)
+
+    case_1 = (allowed_first == PARALLEL) & (allowed_b == PARALLEL) \
+        | (location_first == allowed_first) | (location_first == PARALLEL) | (location_b == negated_side_b) | (location_b == PARALLEL)
+    case_2 = (allowed_first == PARALLEL) | (location_first == allowed_first) | (location_first == PARALLEL)
+    case_3 = (allowed_first == PARALLEL) | (location_first != allowed_first)
+
+    # the parts of a/b that are left after trimming them to the shared vertex can be too short to have a side
+    too_short = (edge_cases != 1) & (np.hypot(*(first_ends - first_starts).T) < min_length)
+    return np.select([edge_cases == 1, edge_cases == 2], [case_1, case_2], case_3) | too_short
+
+
+def trim_translation_vector(source_coords: np.ndarray, target_coords: np.ndarray, translation_vector: tuple, shared_vertices: list, known_intersection, reverse: bool = False) -> tuple:
+    # moves every vertex of source along the translation and finds the first point where one of them runs into target
+    # returns the trimmed vector and the point where that happened
+    # all vertices against all edges in one pass, coordinates are rings without closing point (see OrbitPolygon)
     dx, dy = translation_vector
     if reverse:
         dx, dy = -dx, -dy
 
-    for x, y in source_poly.exterior.coords[:-1]:
-        start = (x, y)
-        end = (x + dx, y + dy)
-
-        if end in source_poly.exterior.coords:
-            continue
-        if start in target_poly.exterior.coords and end in target_poly.exterior.coords:
-            continue
-
-        path = LineString([start, end])
-        intersection = precision_aware_intersection(path, target_poly)
-
-        if not intersection.is_empty:
-            if intersection.geom_type == "Point":
-                intersection_point = intersection.coords[0]
-                if intersection in shared_vertices:
-                    continue
-                # second check: in case of (Multi)LineString intersection, a vertex may be along the intersection without being mentioned in the shared_vertices
-                if known_intersection.geom_type in ["LineString", "MultiLineString"]:
-                    if intersection_point_is_within_linestring(intersection_point, known_intersection):
-                        continue
-            elif intersection.geom_type == "LineString":  # can happen in edge cases 2 and 3
-                intersection_point = intersection.coords[0]
-                if Point(intersection_point) in shared_vertices or Point(intersection.coords[1]) in shared_vertices:
-                    continue
-                if known_intersection.geom_type in ["LineString", "MultiLineString"]:
-                    if intersection_point_is_within_linestring(intersection_point, known_intersection):
-                        continue
-            else:
-                # example: GEOMETRYCOLLECTION (LINESTRING (10.571428571428571 9.714285714285714, 11 10), POINT (8 8))
-                intersection_point = find_closest_intersection(start, intersection)
-                if Point(intersection_point) in shared_vertices:
-                    continue
-
-            # Set vector to go only up to the intersection point
-            ix, iy = intersection_point
-            dx = round(ix - start[0], NO_OF_ROUNDING_DIGITS)
-            dy = round(iy - start[1], NO_OF_ROUNDING_DIGITS)
+    starts = source_coords
+    ends = snap(starts + (dx, dy))  # the paths are snapped as well, like precision_aware_intersection would
+    paths = ends - starts
+    edge_starts = target_coords
+    edges = np.roll(target_coords, -1, axis=0) - target_coords
+
+    # vertices that end up on another one of their own vertices, or that run along target from vertex to vertex, never trim
+    source_keys = grid_keys(starts)
+    target_keys = grid_keys(target_coords)
+    end_keys = grid_keys(ends)
+    skipped = np.isin(end_keys, source_keys) | (np.isin(source_keys, target_keys) & np.isin(end_keys, target_keys))
+
+    # (n, m) tables: path of source vertex i against target edge j
+    to_edge_start = edge_starts[None, :, :] - starts[:, None, :]
+    denominator = cross(paths[:, None, :], edges[None, :, :])
+    parallel = np.abs(denominator) <= SNAP_TOLERANCE ** 2
+    safe_denominator = np.where(parallel, 1.0, denominator)
+    t = cross(to_edge_start, edges[None, :, :]) / safe_denominator  # fraction along the path
+    u = cross(to_edge_start, paths[:, None, :]) / safe_denominator  # fraction along the edge
+
+    path_lengths = np.maximum(np.hypot(paths[:, 0], paths[:, 1]), SNAP_TOLERANCE)[:, None]
+    edge_lengths = np.maximum(np.hypot(edges[:, 0], edges[:, 1]), SNAP_TOLERANCE)[None, :]
+    t_tolerance = SNAP_TOLERANCE / path_lengths  # snapping moves intersections by up to half a grid cell
+    u_tolerance = SNAP_TOLERANCE / edge_lengths
+    crossing = ~parallel & (t >= -t_tolerance) & (t <= 1 + t_tolerance) & (u >= -u_tolerance) & (u <= 1 + u_tolerance)
+
+    # parallel paths only hit an edge if they run along it, and then they hit it where the overlap starts
+    squared_path_lengths = path_lengths ** 2
+    t_edge_start = np.einsum("ijk,ik->ij", to_edge_start, paths) / squared_path_lengths
+    t_edge_end = t_edge_start + np.einsum("jk,ik->ij", edges, paths) / squared_path_lengths
+    on_path_line = np.abs(cross(to_edge_start, paths[:, None, :])) / path_lengths <= SNAP_TOLERANCE
+    collinear = parallel & on_path_line & (np.maximum(t_edge_start, t_edge_end) >= -t_tolerance) & (np.minimum(t_edge_start, t_edge_end) <= 1 + t_tolerance)
+
+    t_overlap_start = np.minimum(t_edge_start, t_edge_end)
+    hit_fractions = np.where(crossing, t, np.where(collinear, t_overlap_start, np.inf))
+    hit_fractions = np.clip(hit_fractions, 0, None)
+    hit_points = snap(starts[:, None, :] + np.minimum(hit_fractions, 1)[:, :, None] * paths[:, None, :])
+
+    # touching points that are already known are not a reason to stop
+    excluded_points = [(point.x, point.y) for point in shared_vertices]
+    if known_intersection.geom_type == "LineString":
+        excluded_points.extend(known_intersection.coords)
+    elif known_intersection.geom_type == "MultiLineString":
+        for linestring in known_intersection.geoms:
+            excluded_points.extend(linestring.coords)
+    excluded_keys = grid_keys(np.array(excluded_points, dtype=float).reshape(-1, 2))
+    hit_fractions[np.isin(grid_keys(hit_points), excluded_keys) | skipped[:, None]] = np.inf
+
+    # neither is sliding along target from a known touching point, that only stops where target's boundary turns into the path
+    t_overlap_end = np.maximum(t_edge_start, t_edge_end)
+    for i in np.flatnonzero(np.isin(source_keys, excluded_keys) & collinear.any(axis=1)):
+        slide_end = 0.0
+        for overlap_start, overlap_end in sorted(zip(t_overlap_start[i, collinear[i]], t_overlap_end[i, collinear[i]])):
+            if overlap_start > slide_end + t_tolerance[i, 0]:
+                break
+            slide_end = max(slide_end, overlap_end)
+
+        probe = starts[i] + min(slide_end + 2 * t_tolerance[i, 0], 1) * paths[i]
+        if slide_end < 1 and points_in_ring(probe[None, :], target_coords)[0]:
+            hit_fractions[i, hit_fractions[i] < slide_end - t_tolerance[i, 0]] = np.inf
+        else:
+            hit_fractions[i, hit_fractions[i] <= slide_end + t_tolerance[i, 0]] = np.inf
+
+    # the new contact is where the two polygons will touch after the move (None if nothing was hit)
+    contact = None
+    i, j = np.unravel_index(np.argmin(hit_fractions), hit_fractions.shape)
+    if np.isfinite(hit_fractions[i, j]):
+        # set vector to go only up to the intersection point
+        ix, iy = hit_points[i, j]
+        dx = round(ix - starts[i, 0], NO_OF_ROUNDING_DIGITS)
+        dy = round(iy - starts[i, 1], NO_OF_ROUNDING_DIGITS)
+        contact = (float(starts[i, 0]), float(starts[i, 1])) if reverse else (float(ix), float(iy))  # in reverse, the source is the static one
+
     # If reverse, flip vector back to match original direction
     if reverse:
-        return (-dx, -dy)
-
-    return (dx, dy)
-
-
-def intersection_point_is_within_linestring(intersection_coords: tuple, intersection: LineString | MultiLineString) -> bool:
-    # if intersections within a linestring are allowed, use distance() instead
-    if isinstance(intersection, LineString):
-        return intersection_coords in intersection.coords
-
-    elif isinstance(intersection, MultiLineString):
-        for linestring in intersection.geoms:
-            if intersection_coords in linestring.coords:
-                return True
-        return False
-
-
-def find_closest_intersection(start: tuple, geometry_collection) -> tuple | None:
-    start_point = Point(start)
-    closest_point = None
-    min_distance = float("inf")
-
-    geoms = (geometry_collection.geoms if hasattr(geometry_collection, "geoms") else [geometry_collection])
-
-    for geom in geoms:
-        if geom.is_empty:
-            continue
+        return (-dx, -dy), contact
 
-        if isinstance(geom, Point):
-            if geom.equals(start_point):
-                continue  # skip exact start point
-            dist = start_point.distance(geom)
-            if dist < min_distance:
-                closest_point = geom
-                min_distance = dist
-
-        elif isinstance(geom, LineString):
-            p1, p2 = nearest_points(start_point, geom)
-            if p2.equals(start_point):
-                continue  # again, skip exact start
-            dist = start_point.distance(p2)
-            if dist < min_distance:
-                closest_point = p2
-                min_distance = dist
-
-    return (closest_point.x, closest_point.y)
+    return (dx, dy), contact
 
 
 def is_closed_loop(nfp, tol=0.2):
     if len(nfp) < 3:
         return False
     start = Point(nfp[0])
-    end = Point(nfp[-1])
-    return start.distance(end) < tol
+    # a translation can slide along a straight part of the NFP right past the start without stopping on it
+    last_move = LineString(nfp[-2:])
+    return start.distance(last_move) < tol
 
 
 def normalize_vector(v: tuple, length: float) -> tuple:
@@ -365,6 +390,32 @@ def cap_translation_vectors(vectors: list, length: float) -> list:
 
 # ----- more general helpers -----
 
+def snap(coords: np.ndarray) -> np.ndarray:
+    # same grid snapping (round half up) that set_precision() does, without building a geometry
+    return np.floor(np.asarray(coords) * GRID_SCALE + 0.5) / GRID_SCALE
+
+
+def grid_keys(coords: np.ndarray) -> np.ndarray:
+    # one integer per point, equal for points that snap to the same grid cell
+    cells = np.floor(np.asarray(coords) * GRID_SCALE + 0.5).astype(np.int64)
+    return cells[..., 0] * 2**32 + cells[..., 1]
+
+
+def cross(v: np.ndarray, w: np.ndarray) -> np.ndarray:
+    return v[..., 0] * w[..., 1] - v[..., 1] * w[..., 0]
+
+
+def points_in_ring(points: np.ndarray, ring: np.ndarray) -> np.ndarray:
+    # crossing number test for many points at once, ring without closing point, points on the boundary are undefined
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    straddles = (y1 > y) != (y2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_crossing = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(straddles & (x < x_crossing), axis=1) % 2 == 1
+
+
 def precision_aware_intersection(obj1, obj2, precision=INTERSECTION_PRECISION):
     obj1_snapped = set_precision(obj1, precision)
     obj2_snapped = set_precision(obj2, precision)
@@ -394,19 +445,6 @@ def angle_from_points(point_a: tuple, point_b: tuple, point_c: tuple) -> float:
     return angle_deg
 
 
-def get_edges(polygon):
-    coords = list(polygon.exterior.coords)
-    edges = [LineString([coords[i], coords[i+1]]) for i in range(len(coords)-1)]
-    return edges
-
-
-def find_edge_index(poly_edges: list, edge: LineString) -> int:
-    for i, e in enumerate(poly_edges):
-        if e.equals(edge):
-            return i
-    raise Exception("Cannot find specified edge in polygon")
-
-
 def longest_vector(vectors: list) -> tuple:
     max_length = 0
     longest_index = 0
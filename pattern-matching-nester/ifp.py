@@ -1,15 +1,19 @@
+from fixed_point import fixed_ifp
+from helper import nfp_reference_point
+
 # input_points = [(14.2, 147.0), (14.2, 154.0), (0.0, 154.0), (-14.2, 154.0), (-14.2, 147.0), (0.0, 147.0)]
 input_points_local = [(180.1, 147.0), (170.3, 147.0), (160.5, 147.0), (160.5, 154.0), (170.3, 154.0), (180.1, 154.0)]
 
 reference_point_local = input_points_local[0]
 
-fabric_length = 200  # = x
-fabric_width = 150   # = y
 
 fabric_vertices = [(0, 0), (200, 0), (200, 150), (0, 150)]
 
-def ifp(input_points: list, fabric_vertices: list) -> list:
-    reference_point = min(input_points, key=lambda v: (v[0], v[1]))
+def ifp(input_points: list, fabric_vertices: list, kernel: str = "float") -> list:
+    if kernel == "fixed":
+        return fixed_ifp(input_points, fabric_vertices)
+
+    reference_point = nfp_reference_point(input_points)
 
     # Transpose the list of tuples to separate x and y values
     x_vals, y_vals = zip(*input_points)
@@ -19,10 +23,12 @@ def ifp(input_points: list, fabric_vertices: list) -> list:
     max_x = max(x_vals)
     max_y = max(y_vals)  # to make axis-aligned bounding box of the piece
 
-    ifp_min_x = reference_point[0] - min_x
-    ifp_max_x = fabric_length - (max_x - reference_point[0])
-    ifp_min_y = reference_point[1] - min_y
-    ifp_max_y = fabric_width - (max_y - reference_point[1])
+    fabric_x_vals, fabric_y_vals = zip(*fabric_vertices)  # only the fabric's bounding box matters
+
+    ifp_min_x = min(fabric_x_vals) + reference_point[0] - min_x
+    ifp_max_x = max(fabric_x_vals) - (max_x - reference_point[0])
+    ifp_min_y = min(fabric_y_vals) + reference_point[1] - min_y
+    ifp_max_y = max(fabric_y_vals) - (max_y - reference_point[1])
     print(ifp_min_x, ifp_max_x)
 
     ifp = [(ifp_min_x, ifp_min_y), (ifp_max_x, ifp_min_y), (ifp_max_x, ifp_max_y), (ifp_min_x, ifp_max_y)]
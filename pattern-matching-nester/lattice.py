@@ -0,0 +1,90 @@
+import math
+
+import numpy as np
+
+import shapely
+from shapely.geometry import Polygon
+
+from stripes import PHASE_TOLERANCE, seam_links, propagate_phases
+
+LATTICE_BATCH = 4096  # candidate points tested against the region at once
+
+
+def lattice_basis(lattice: tuple) -> np.ndarray:
+    # ((ax, ay), (bx, by)) repeat vectors -> 2x2 matrix with them as columns
+    basis = np.array(lattice, dtype=float).T
+    if basis.shape != (2, 2) or abs(np.linalg.det(basis)) < 1e-9:
+        raise ValueError(f"Lattice needs two independent repeat vectors, got {lattice}")
+    return basis
+
+
+def lattice_offset(lattice: tuple, phase: tuple) -> tuple:
+    # phase in lattice coordinates (fractions of the repeat vectors) -> (x, y) offset
+    offset = lattice_basis(lattice) @ np.asarray(phase, dtype=float)
+    return float(offset[0]), float(offset[1])
+
+
+def lattice_points(bounds: tuple, lattice: tuple, origin: tuple = (0, 0)) -> np.ndarray:
+    # every origin + i * a + j * b inside the bounds (x_min, y_min, x_max, y_max), leftest lowest first
+    basis = lattice_basis(lattice)
+    x_min, y_min, x_max, y_max = bounds
+    corners = np.array([[x_min, y_min], [x_max, y_min], [x_min, y_max], [x_max, y_max]]) - origin
+    index_corners = np.linalg.solve(basis, corners.T)  # the corners in lattice coordinates
+    i_range = np.arange(math.floor(index_corners[0].min() - 1e-9), math.ceil(index_corners[0].max() + 1e-9) + 1)
+    j_range = np.arange(math.floor(index_corners[1].min() - 1e-9), math.ceil(index_corners[1].max() + 1e-9) + 1)
+    i, j = np.meshgrid(i_range, j_range, indexing="ij")
+    points = np.round(np.asarray(origin) + np.stack([i.ravel(), j.ravel()], axis=1) @ basis.T, 2)
+
+    eps = 1e-9
+    inside = (points[:, 0] >= x_min - eps) & (points[:, 0] <= x_max + eps) & (points[:, 1] >= y_min - eps) & (points[:, 1] <= y_max + eps)
+    points = points[inside]
+    return points[np.lexsort((points[:, 1], points[:, 0]))]
+
+
+def bottom_left_on_lattice(region, lattice: tuple, origin: tuple = (0, 0), batch_size: int = LATTICE_BATCH, contains=None) -> tuple | None:
+    """
+    The leftest (then lowest) lattice point in the region, None if there is none.
+    - candidates are enumerated over the region's bounds and tested in batches of vectorized point in polygon checks,
+      so a free spot near the left edge doesn't pay for the rest of the fabric
+    - points on the region's border count, that's where the piece touches its neighbours
+    - contains: the point test, (n, 2) points -> booleans, like FeasibleRegion.contains (default: against the region as it is)
+    """
+    if region.is_empty:
+        return None
+    points = lattice_points(region.bounds, lattice, origin)
+    for start in range(0, len(points), batch_size):
+        batch = points[start:start + batch_size]
+        inside = np.flatnonzero(contains(batch) if contains is not None else shapely.intersects_xy(region, batch[:, 0], batch[:, 1]))
+        if len(inside):
+            x, y = batch[inside[0]]
+            return float(x), float(y)
+    return None
+
+
+def seam_lattice_phases(pattern, lattice: tuple, tolerance: float = PHASE_TOLERANCE) -> tuple:
+    """
+    Like stripes.seam_stripe_phases for fabrics that repeat in both directions (plaid, checks).
+    Phases are in lattice coordinates, fractions in [0, 1) of the two repeat vectors.
+    Returns (piece index -> (u, v), ids of the seams that can't be matched because of a cycle).
+    """
+    basis = lattice_basis(lattice)
+
+    def add(phase: tuple, offset: tuple, sign: int) -> tuple:
+        shifted = np.asarray(phase) + sign * np.linalg.solve(basis, np.asarray(offset, dtype=float))
+        return tuple(float(x) for x in np.round(shifted % 1, 6) % 1)
+
+    def mismatch(phase: tuple, other_phase: tuple) -> bool:
+        difference = (np.asarray(phase) - np.asarray(other_phase) + 0.5) % 1 - 0.5  # closest repeat
+        return float(np.linalg.norm(basis @ difference)) > tolerance
+
+    return propagate_phases(pattern, seam_links(pattern), (0.0, 0.0), add, mismatch)
+
+
+if __name__ == '__main__':
+    region = Polygon([(0, 0), (50, 0), (50, 35), (0, 35)], [[(-1, 10), (20, 10), (20, 25), (-1, 25)]]).buffer(0)
+    print(bottom_left_on_lattice(region, ((10, 0), (0, 10))))
+    print(bottom_left_on_lattice(region.difference(Polygon([(-1, -1), (3, -1), (3, 40), (-1, 40)])), ((10, 0), (5, 10)), (1, 0.5)))
+
+    # seam matched plaid on the default (orbital) engine, placed pieces end up on fractional lattice positions
+    from nester import main as nest
+    nest(["data/turtleneck_with_seams.svg", "--lattice", "10", "0", "0", "10", "--match-seams"])
@@ -0,0 +1,233 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from shapely import set_precision, orient_polygons, union_all
+from shapely.geometry import Polygon
+
+from helper import INTERSECTION_PRECISION
+
+CONVEXITY_TOLERANCE = INTERSECTION_PRECISION ** 2  # cross products below this count as collinear
+SHAPE_CLASSES = ("rectangle", "convex", "general")  # cheapest NFP first
+
+
+def ccw_vertices(polygon: Polygon) -> np.ndarray:
+    coords = np.asarray(orient_polygons(polygon).exterior.coords, dtype=float)[:-1]  # cut off closing point
+    edges = np.roll(coords, -1, axis=0) - coords
+    return coords[np.any(edges != 0, axis=1)]  # drop repeated vertices, they produce zero-length edges
+
+
+def turns(coords: np.ndarray) -> np.ndarray:
+    # cross product of each edge with the next one, > 0 means a left turn at the vertex between them
+    edges = np.roll(coords, -1, axis=0) - coords
+    next_edges = np.roll(edges, -1, axis=0)
+    return edges[:, 0] * next_edges[:, 1] - edges[:, 1] * next_edges[:, 0]
+
+
+def is_convex_ring(coords: np.ndarray) -> bool:
+    if len(coords) < 3:
+        return False
+    return bool(np.all(turns(coords) >= -CONVEXITY_TOLERANCE))  # ccw, so every turn has to be a left turn (or straight)
+
+
+def is_convex(polygon: Polygon) -> bool:
+    return is_convex_ring(ccw_vertices(polygon))
+
+
+def minkowski_sum_convex(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    # both inputs: anti-clockwise vertices of a convex polygon, without closing point
+    # start both at their lowest (then leftest) vertex, from there the edge angles are increasing in [0, 2pi)
+    p = np.roll(p, -np.lexsort((p[:, 0], p[:, 1]))[0], axis=0)
+    q = np.roll(q, -np.lexsort((q[:, 0], q[:, 1]))[0], axis=0)
+
+    edges = np.concatenate((np.roll(p, -1, axis=0) - p, np.roll(q, -1, axis=0) - q))
+    angles = np.mod(np.arctan2(edges[:, 1], edges[:, 0]), 2 * np.pi)
+    merged_edges = edges[np.argsort(angles, kind="stable")]
+
+    # the lowest point of the sum is the sum of the lowest points, walk the merged edges from there
+    return p[0] + q[0] + np.concatenate(([(0.0, 0.0)], np.cumsum(merged_edges, axis=0)[:-1]))
+
+
+def convex_pair_nfp(a_coords: np.ndarray, b_coords: np.ndarray, reference: tuple) -> np.ndarray:
+    # the positions of B's reference vertex where convex A and B overlap are A + (-B), shifted by that vertex
+    return minkowski_sum_convex(a_coords, -b_coords) + np.asarray(reference[:2])  # point reflection keeps -B anti-clockwise
+
+
+def convex_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
+    # same contract as nfp.nfp(): the NFP is the path of B's highest vertex while orbiting A
+    pt_b_ymax = max(b_poly_untranslated.exterior.coords, key=lambda p: p[1])
+    nfp_coords = convex_pair_nfp(ccw_vertices(a_poly_raw), ccw_vertices(b_poly_untranslated), pt_b_ymax)
+    return set_precision(Polygon(nfp_coords), INTERSECTION_PRECISION)
+
+
+# ----- convex decomposition -----
+
+def remove_collinear_vertices(coords: np.ndarray) -> np.ndarray:
+    while len(coords) > 3:
+        collinear = np.abs(turns(coords)) <= CONVEXITY_TOLERANCE
+        if not collinear.any():
+            break
+        coords = coords[~np.roll(collinear, 1)]  # turns()[i] belongs to vertex i + 1
+    return coords
+
+
+def triangulate(coords: np.ndarray) -> list:
+    # ear clipping on an anti-clockwise simple polygon, returns triangles as index triples
+    indices = list(range(len(coords)))
+    triangles = []
+    while len(indices) > 3:
+        ring = coords[indices]
+        ring_turns = np.roll(turns(ring), 1)  # now ring_turns[k] belongs to vertex k
+        for k in np.flatnonzero(ring_turns > CONVEXITY_TOLERANCE):  # reflex vertices can't be ears
+            prev_k, next_k = k - 1, (k + 1) % len(indices)
+            a, b, c = ring[prev_k], ring[k], ring[next_k]
+            others = np.delete(ring, [prev_k, k, next_k], axis=0)
+            # an ear must not contain (or touch) any other vertex
+            inside = np.ones(len(others), dtype=bool)
+            for start, end in ((a, b), (b, c), (c, a)):
+                inside &= (end[0] - start[0]) * (others[:, 1] - start[1]) - (end[1] - start[1]) * (others[:, 0] - start[0]) >= -CONVEXITY_TOLERANCE
+            if not inside.any():
+                triangles.append((indices[prev_k], indices[k], indices[next_k]))
+                indices.pop(k)
+                break
+        else:
+            # clipping can leave collinear vertices behind, dropping them doesn't change the shape
+            collinear = np.flatnonzero(np.abs(ring_turns) <= CONVEXITY_TOLERANCE)
+            if not len(collinear):
+                raise Exception("Polygon could not be triangulated, is it self-intersecting?")
+            indices.pop(collinear[0])
+    triangles.append(tuple(indices))
+    return triangles
+
+
+def merge_convex_parts(coords: np.ndarray, parts: list) -> list:
+    # Hertel-Mehlhorn: remove diagonals between two parts as long as the merged part stays convex
+    parts = [list(part) for part in parts]
+    merged = True
+    while merged:
+        merged = False
+        edge_owner = {}
+        for part_index, part in enumerate(parts):
+            for i in range(len(part)):
+                edge_owner[(part[i], part[(i + 1) % len(part)])] = part_index
+
+        for (u, v), p_index in edge_owner.items():
+            q_index = edge_owner.get((v, u))
+            if q_index is None or q_index == p_index:
+                continue
+            p, q = parts[p_index], parts[q_index]
+            p_rotated = p[p.index(v):] + p[:p.index(v)]  # v ... u
+            q_rotated = q[q.index(u):] + q[:q.index(u)]  # u ... v
+            candidate = p_rotated + q_rotated[1:-1]
+            if is_convex_ring(coords[candidate]):
+                parts[p_index] = candidate
+                parts.pop(q_index)
+                merged = True
+                break
+    return parts
+
+
+def convex_decomposition(polygon: Polygon) -> list:
+    coords = remove_collinear_vertices(ccw_vertices(polygon))
+    if is_convex_ring(coords):
+        return [coords]
+    parts = merge_convex_parts(coords, triangulate(coords))
+    return [coords[part] for part in parts]
+
+
+@lru_cache(maxsize=256)
+def __local_convex_decomposition(local_coords: tuple) -> tuple:
+    return tuple(convex_decomposition(Polygon(local_coords)))
+
+
+def cached_convex_decomposition(polygon: Polygon) -> list:
+    # pieces only ever get translated, so the decomposition is done once in the piece's local frame
+    coords = list(polygon.exterior.coords)[:-1]
+    origin = np.asarray(coords[0])
+    local_coords = tuple((x - coords[0][0], y - coords[0][1]) for x, y in coords)
+    return [part + origin for part in __local_convex_decomposition(local_coords)]
+
+
+def decomposition_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
+    # NFP of two arbitrary simple polygons as the union of the NFPs of all their convex parts
+    pt_b_ymax = max(b_poly_untranslated.exterior.coords, key=lambda p: p[1])
+    a_parts = cached_convex_decomposition(a_poly_raw)
+    b_parts = cached_convex_decomposition(b_poly_untranslated)
+
+    part_nfps = [Polygon(convex_pair_nfp(a_part, b_part, pt_b_ymax)) for a_part in a_parts for b_part in b_parts]
+    return set_precision(union_all(part_nfps), INTERSECTION_PRECISION)
+
+
+# ----- axis-aligned rectangles -----
+
+def is_axis_aligned_rectangle(polygon: Polygon) -> bool:
+    # a simple polygon that fills its bounding box is that box (extra vertices on its sides are fine)
+    min_x, min_y, max_x, max_y = polygon.bounds
+    return polygon.area > 0 and math.isclose(polygon.area, (max_x - min_x) * (max_y - min_y), rel_tol=1e-9)
+
+
+def classify_shape(polygon: Polygon) -> str:
+    if is_axis_aligned_rectangle(polygon):
+        return "rectangle"
+    if is_convex(polygon):
+        return "convex"
+    return "general"
+
+
+@lru_cache(maxsize=1024)
+def __local_shape_class(local_coords: tuple) -> str:
+    return classify_shape(Polygon(local_coords))
+
+
+def cached_classify_shape(polygon: Polygon) -> str:
+    # like cached_convex_decomposition(), every pair the nester routes classifies the same few shapes again
+    coords = list(polygon.exterior.coords)[:-1]
+    return __local_shape_class(tuple((x - coords[0][0], y - coords[0][1]) for x, y in coords))
+
+
+def stretch_rectangle(rect: Polygon, offsets: tuple) -> Polygon:
+    """
+    Stretches an axis-aligned rectangle on the given axis.
+
+    Parameters:
+    - rect: A shapely Polygon representing a rectangle.
+    - offsets: amount to move the corresponding side (min_x, max_x, min_y, max_y).
+
+    Returns:
+    - A new Polygon with the stretched shape.
+    """
+    coords = list(rect.exterior.coords)[:-1]
+    minx, miny, maxx, maxy = rect.bounds
+    new_coords = []
+
+    for x, y in coords:
+        if x == maxx:
+            x += offsets[1]
+        if x == minx:
+            x -= offsets[0]
+        if y == maxy:
+            y += offsets[3]
+        if y == miny:
+            y -= offsets[2]
+        new_coords.append((x, y))
+    new_coords.append(new_coords[0])
+
+    return Polygon(new_coords)
+
+
+def simple_nfp(static_poly: Polygon, orbiting_poly: Polygon, reference_point: tuple) -> Polygon:
+    # assumption: 2 rectangles and reference point is on a corner
+    minx, miny, maxx, maxy = orbiting_poly.bounds
+    max_x_offset = reference_point[0] - minx  # the offset FOR max x
+    min_x_offset = maxx - reference_point[0]
+    max_y_offset = reference_point[1] - miny
+    min_y_offset = maxy - reference_point[1]
+    static_poly = stretch_rectangle(static_poly, (min_x_offset, max_x_offset, min_y_offset, max_y_offset))
+    return static_poly
+
+
+def rectangle_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
+    # same contract as nfp.nfp(), for two axis-aligned rectangles the NFP is just A grown by B
+    pt_b_ymax = max(b_poly_untranslated.exterior.coords, key=lambda p: p[1])
+    return set_precision(simple_nfp(a_poly_raw, b_poly_untranslated, pt_b_ymax), INTERSECTION_PRECISION)
@@ -1,7 +1,9 @@
 class Pattern():
-    def __init__(self, pieces: list, seams: list):
+    def __init__(self, pieces: list, seams: list, part_frames: dict = None, unit_scale: float = 1):
         self.pieces = pieces
         self.seams = seams
+        self.part_frames = part_frames or {}  # part name -> frame of its seam coordinates, see svg_helper.part_frames
+        self.unit_scale = unit_scale
 
     def __str__(self):
         return ";\n".join([str(x) for x in self.pieces]) if self.pieces else ""
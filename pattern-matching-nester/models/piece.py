@@ -1,6 +1,9 @@
 from svgpathtools import Path, Line, Arc, CubicBezier, QuadraticBezier
 from shapely.geometry import Polygon
 
+from minkowski import cached_classify_shape
+from orientation import IDENTITY, compose, inverse, orient_vertices
+
 COORDINATE_DECIMAL_PLACES = 1
 
 class Piece():
@@ -10,6 +13,19 @@ class Piece():
         self.path = path
         self.vertices = self.__extract_vertices(unit_scale)
         self.aabb = None
+        self.orientation = IDENTITY  # the vertices are the loaded piece in this orientation (see orientation.py)
+        self.orientations = [IDENTITY]  # the ones the nester may choose from
+
+    @classmethod
+    def from_vertices(cls, index: int, name: str, vertices: list) -> "Piece":
+        # for pieces that only exist as polygons (e.g. copies sent to worker processes), there is no path then
+        piece = cls(index, name, None, 1)
+        piece.vertices = list(vertices)
+        return piece
+
+    def oriented_vertices(self, orientation: tuple) -> list:
+        # the vertices of the loaded piece in that orientation, around the origin like the loaded ones
+        return orient_vertices(self.vertices, compose(inverse(self.orientation), orientation))
 
     def __str__(self):
         return f"Index: {self.index}, Vertices: {self.vertices}"
@@ -50,3 +66,7 @@ class Piece():
     def area(self):
         polygon = Polygon(self.vertices)
         return polygon.area
+
+    def shape_class(self) -> str:
+        # "rectangle", "convex" or "general" (see minkowski.SHAPE_CLASSES), from the same cache route_nfp() uses
+        return cached_classify_shape(Polygon(self.vertices))
@@ -0,0 +1,387 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from dataclasses import dataclass, asdict
+
+from shapely import Polygon
+
+from models.piece import Piece
+from models.pattern import Pattern
+from svg_helper import get_svg_attributes, load_selected_paths, parse_svg_metadata, merge_pieces_with_common_vertices, reduce_seams, reindex, part_frames
+from ifp import ifp
+from helper import nfp_reference_point
+from nfp import oriented_nfps, NFP_ENGINES, NFP_KERNELS, engine_usage
+from nfp_cache import NfpCache, default_cache
+from nfp_store import NfpStore
+from feasible_region import FeasibleRegion, shape_key
+from parallel import make_executor, EXECUTOR_KINDS
+from stripes import STRIPE_SPACING, stripe_intervals, stripe_lines, bottom_left_on_stripes, phase_rows, seam_stripe_phases
+from lattice import bottom_left_on_lattice, lattice_offset, seam_lattice_phases
+from orientation import IDENTITY, GRAIN_ROTATIONS, allowed_orientations
+
+FABRIC_VERTICES = [(0, 0), (200, 0), (200, 150), (0, 150)]
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INTERVAL = 30  # seconds
+
+
+class NoFeasiblePosition(Exception):
+    # the piece doesn't fit anywhere on what is left of the fabric
+    pass
+
+
+def fabric_rectangle(length: float, width: float) -> list:
+    return [(0, 0), (length, 0), (length, width), (0, width)]
+
+
+def generate_stripe_segments(ifp: Polygon, fabric_vertices: list = FABRIC_VERTICES, stripe_spacing: int = STRIPE_SPACING) -> list:
+    # the stripe rows inside the IFP (or the whole fabric) as LineStrings, for drawing, placing uses the intervals directly
+    if ifp is None:
+        ifp = Polygon(fabric_vertices)
+    return stripe_lines(*stripe_intervals(ifp, stripe_spacing))
+
+
+def load_pattern(svg_file: str, merge_pieces: bool = True, merge_sleeves: bool = True, allowed_class_lists: list = None) -> Pattern:
+    # the same preprocessing the demo does: parse, merge pieces that share a seam line, biggest pieces first
+    if not os.path.exists(svg_file):
+        raise FileNotFoundError(f"SVG file not found: {svg_file}")
+
+    svg_attributes = get_svg_attributes(svg_file)
+    unit_scale = 0.1 if "mm" in svg_attributes.get("height", "") else 1
+
+    paths = load_selected_paths(svg_file, allowed_class_lists, merge_sleeves)
+    pieces = [Piece(index, name, path, unit_scale) for index, (name, path) in enumerate(paths)]
+    seams = parse_svg_metadata(svg_file)
+    frames = part_frames(paths, seams)
+
+    merged_pieces = reindex(merge_pieces_with_common_vertices(pieces, unit_scale)) if merge_pieces else pieces
+    merged_pieces.sort(key=lambda p: p.area(), reverse=True)
+    reduced_seams = reduce_seams(merged_pieces, seams) if merge_pieces else seams
+    return Pattern(merged_pieces, reduced_seams, frames, unit_scale)
+
+
+def translate_piece(piece: Piece, translation: tuple) -> None:
+    piece.vertices = [(x + translation[0], y + translation[1]) for x, y in piece.vertices]
+
+
+@dataclass
+class Placement:
+    index: int
+    name: str
+    translation: tuple
+    vertices: list
+    rotation: float = 0  # the piece was rotated by this (degrees) before it got translated
+    mirrored: bool = False  # ... and mirrored before that, see orientation.py
+
+
+class Nester():
+    """
+    The IFP -> NFP -> bottom-left pipeline of demo.PolygonViewer, without any drawing.
+    Pieces are placed in the given order, each one at the lowest-leftmost point that is still feasible
+    (on a stripe, if stripes are switched on), and their vertices are translated in place.
+    Pieces with more than one allowed orientation go in whichever of them reaches furthest to the bottom left.
+    """
+    def __init__(self, fabric_vertices: list = FABRIC_VERTICES, stripe_spacing: int = STRIPE_SPACING, stripes: bool = True,
+                 engine: str = "orbital", kernel: str = "float", cache: NfpCache = default_cache, executor=None, stripe_phases: dict = None,
+                 lattice: tuple = None, lattice_phases: dict = None):
+        self.fabric_vertices = fabric_vertices
+        self.stripe_spacing = stripe_spacing
+        self.stripes = stripes
+        self.engine = engine
+        self.kernel = kernel
+        self.cache = cache
+        self.executor = executor
+        self.stripe_phases = stripe_phases or {}  # piece index -> y of its reference point modulo stripe_spacing, for matched seams
+        self.lattice = lattice  # two repeat vectors of a plaid, reference points only go onto its points (instead of stripes)
+        self.lattice_phases = lattice_phases or {}  # piece index -> (u, v) offset in lattice coordinates, for matched seams
+        self.placed_pieces = []
+        self.feasible_regions = {}  # shape key -> FeasibleRegion, kept up to date lazily
+        self.last_region = None  # feasible region used for the last placement (None for the first piece)
+        self.placements = []  # everything on the fabric, including restored placements
+        self.remaining = []  # pieces fit_all didn't get to before its deadline
+        self.fallback_placements = []  # where fit_all put those anyway, see fallback_fit()
+
+    def ifp_for(self, piece: Piece) -> list:
+        return ifp(piece.vertices, self.fabric_vertices, kernel=self.kernel)
+
+    def feasible_region_for(self, piece: Piece, ifp_vertices: list = None) -> FeasibleRegion:
+        piece_polygon = Polygon(piece.vertices)
+        key = shape_key(piece_polygon)
+        if key not in self.feasible_regions:
+            self.feasible_regions[key] = FeasibleRegion(Polygon(ifp_vertices or self.ifp_for(piece)), piece_polygon)
+        feasible_region = self.feasible_regions[key]
+
+        # only the pieces placed since this shape was last considered get subtracted
+        reference_point = nfp_reference_point(piece.vertices)
+        placed_polys = [Polygon(x.vertices) for x in self.placed_pieces]
+        orientation_of = {id(polygon): x.orientation for polygon, x in zip(placed_polys, self.placed_pieces)}
+        feasible_region.update(
+            placed_polys,
+            lambda new_placed: oriented_nfps(new_placed, [orientation_of[id(polygon)] for polygon in new_placed], piece_polygon, reference_point,
+                                             engine=self.engine, cache=self.cache, kernel=self.kernel, executor=self.executor)
+        )
+        return feasible_region
+
+    def target_point(self, feasible_region: FeasibleRegion, phase=None) -> tuple:
+        region = feasible_region.region
+        if self.lattice is not None:  # lattice points (shifted by the piece's phase), counted from the fabric's corner
+            fabric_min_x, fabric_min_y, _, _ = Polygon(self.fabric_vertices).bounds
+            offset_x, offset_y = lattice_offset(self.lattice, phase or (0, 0))
+            target_point = bottom_left_on_lattice(region, self.lattice, (fabric_min_x + offset_x, fabric_min_y + offset_y), contains=feasible_region.contains)
+        elif phase is not None:  # only the rows of the piece's stripe phase, counted from the fabric's bottom edge
+            _, y_min, _, y_max = region.bounds if not region.is_empty else (0, 0, 0, -1)
+            rows = phase_rows(y_min, y_max, phase, self.stripe_spacing, Polygon(self.fabric_vertices).bounds[1])
+            target_point = bottom_left_on_stripes(region, self.stripe_spacing, rows)
+        elif self.stripes:
+            target_point = bottom_left_on_stripes(region, self.stripe_spacing)
+        else:  # just use the region's corners
+            candidates = [pt for polygon in getattr(region, "geoms", [region]) if not polygon.is_empty for pt in list(polygon.exterior.coords)[:-1]]
+            target_point = min(candidates, key=lambda p: (p[0], p[1])) if candidates else None
+        if target_point is None:
+            raise NoFeasiblePosition("No feasible position left on the fabric")
+        return target_point
+
+    def place(self, piece: Piece, ifp_vertices: list = None, end_time: float = None) -> tuple:
+        # places the piece and returns the translation that got it there
+        # end_time (time.monotonic()): orientations that aren't tried by then are left out, once one of them fits
+        phase = (self.lattice_phases if self.lattice is not None else self.stripe_phases).get(piece.index)
+        # the seam phases were worked out for the piece as it is, turning it would put its seams elsewhere
+        orientations = [piece.orientation] if phase is not None else piece.orientations
+        candidates = []
+        for orientation in orientations:
+            oriented = piece if orientation == piece.orientation else Piece.from_vertices(piece.index, piece.name, piece.oriented_vertices(orientation))
+            try:
+                target_point, region = self.__target_for(oriented, phase, ifp_vertices if oriented is piece else None)
+            except NoFeasiblePosition:
+                continue  # no room for it in this orientation, the others may still fit
+            candidates.append((target_point, orientation, oriented.vertices, region))
+            if end_time is not None and time.monotonic() >= end_time:
+                break
+        if not candidates:
+            raise NoFeasiblePosition("No feasible position left on the fabric")
+
+        target_point, orientation, vertices, self.last_region = min(candidates, key=lambda c: (c[0][0], c[0][1]))
+        reference_point = nfp_reference_point(vertices)
+        translation = (target_point[0] - reference_point[0], target_point[1] - reference_point[1])
+        piece.vertices, piece.orientation = list(vertices), orientation
+        translate_piece(piece, translation)
+        self.placed_pieces.append(piece)
+        return translation
+
+    def __target_for(self, piece: Piece, phase, ifp_vertices: list = None) -> tuple:
+        # -> (where the piece's reference point would go, feasible region it was picked from or None for the first piece)
+        if not self.placed_pieces and phase is None and self.lattice is None:
+            return sorted(ifp_vertices or self.ifp_for(piece))[0], None  # leftest lowest IFP corner
+        feasible_region = self.feasible_region_for(piece, ifp_vertices)
+        return self.target_point(feasible_region, phase), feasible_region
+
+    def restore(self, placements: list) -> None:
+        # takes over already placed pieces (from a checkpoint or an earlier layout) without placing them again
+        for placement in placements:
+            piece = Piece.from_vertices(placement.index, placement.name, placement.vertices)
+            piece.orientation = (placement.rotation, placement.mirrored)
+            self.placed_pieces.append(piece)
+            self.placements.append(placement)
+
+    def fit_all(self, pieces: list, deadline: float = None, checkpoint_path: str = None, checkpoint_interval: float = CHECKPOINT_INTERVAL) -> list:
+        """
+        Places the pieces in order and returns their placements.
+        - deadline: seconds from now, no new piece (or further orientation of one) is started after that, the piece
+          being placed is finished, a single NFP can't be interrupted. The pieces that are left (self.remaining) are
+          then placed by fallback_fit(), so the layout returned is always complete
+        - checkpoint_path: every checkpoint_interval seconds, and when done or stopped, the state is written there
+          so that a later run can continue with Nester.from_checkpoint. it never contains the fallback placements,
+          resuming places the remaining pieces properly
+        """
+        end_time = time.monotonic() + deadline if deadline is not None else None
+        last_checkpoint = time.monotonic()
+        placements = []
+        self.remaining = list(pieces)
+        while self.remaining:
+            if end_time is not None and time.monotonic() >= end_time:
+                break
+            piece = self.remaining[0]
+            translation = self.place(piece, end_time=end_time)
+            placements.append(Placement(piece.index, piece.name, translation, list(piece.vertices), *piece.orientation))
+            self.placements.append(placements[-1])
+            self.remaining.pop(0)
+            if checkpoint_path and time.monotonic() - last_checkpoint >= checkpoint_interval:
+                self.write_checkpoint(checkpoint_path)
+                last_checkpoint = time.monotonic()
+        if checkpoint_path:
+            self.write_checkpoint(checkpoint_path)
+        self.fallback_placements = self.fallback_fit(self.remaining) if self.remaining else []
+        return placements + self.fallback_placements
+
+    def fallback_fit(self, pieces: list) -> list:
+        """
+        Quick bottom-left placement of the pieces around everything placed so far, for when the deadline is reached.
+        - uses RasterNester, so it takes about as long as one FFT per piece and leaves up to a grid cell per side unused
+        - pieces keep their current orientation, stripe / lattice phases aren't followed
+        - the pieces themselves aren't moved and nothing is added to self.placements, so a checkpoint keeps them as remaining
+        """
+        from raster import RasterNester  # raster builds on this module
+        raster_nester = RasterNester(self.fabric_vertices)
+        raster_nester.restore(self.placements)
+        copies = []
+        for piece in pieces:
+            copies.append(Piece.from_vertices(piece.index, piece.name, piece.vertices))
+            copies[-1].orientation = piece.orientation
+        return raster_nester.fit_all(copies)
+
+    @property
+    def used_fallback(self) -> bool:
+        # True after fit_all reached its deadline and placed self.remaining with fallback_fit()
+        return bool(self.fallback_placements)
+
+    def write_checkpoint(self, path: str) -> None:
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "fabric_vertices": self.fabric_vertices,
+            "stripe_spacing": self.stripe_spacing,
+            "stripes": self.stripes,
+            "engine": self.engine,
+            "kernel": self.kernel,
+            "stripe_phases": self.stripe_phases,
+            "lattice": self.lattice,
+            "lattice_phases": self.lattice_phases,
+            "nfp_store": self.cache.store.path if self.cache.store is not None else None,  # NFPs are only referenced, not copied
+            "placements": [asdict(placement) for placement in self.placements],
+            "remaining": [{"index": piece.index, "name": piece.name, "vertices": piece.vertices,
+                           "orientation": piece.orientation, "orientations": piece.orientations} for piece in self.remaining],
+        }
+        # write next to it and swap, a crash while writing must not destroy the last good checkpoint
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def from_checkpoint(cls, path: str, cache: NfpCache = default_cache, executor=None) -> tuple:
+        # -> (nester with the checkpoint's pieces already placed, pieces that still have to be placed)
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {checkpoint.get('version')}")
+
+        if checkpoint["nfp_store"] and cache.store is None and os.path.exists(checkpoint["nfp_store"]):
+            cache.store = NfpStore(checkpoint["nfp_store"])
+        nester = cls([tuple(vertex) for vertex in checkpoint["fabric_vertices"]], checkpoint["stripe_spacing"], checkpoint["stripes"],
+                     checkpoint["engine"], checkpoint["kernel"], cache, executor,
+                     {int(index): phase for index, phase in checkpoint["stripe_phases"].items()},
+                     tuple(tuple(vector) for vector in checkpoint["lattice"]) if checkpoint["lattice"] else None,
+                     {int(index): tuple(phase) for index, phase in checkpoint["lattice_phases"].items()})
+        nester.restore([
+            Placement(placement["index"], placement["name"], tuple(placement["translation"]),
+                      [tuple(vertex) for vertex in placement["vertices"]], placement["rotation"], placement.get("mirrored", False))
+            for placement in checkpoint["placements"]
+        ])
+        remaining = []
+        for piece_data in checkpoint["remaining"]:
+            piece = Piece.from_vertices(piece_data["index"], piece_data["name"], [tuple(vertex) for vertex in piece_data["vertices"]])
+            piece.orientation = tuple(piece_data.get("orientation", IDENTITY))
+            piece.orientations = [tuple(orientation) for orientation in piece_data.get("orientations", [IDENTITY])]
+            remaining.append(piece)
+        return nester, remaining
+
+
+def marker_stats(placements: list, fabric_vertices: list) -> dict:
+    # how much of the fabric the marker uses, measured up to the rightmost placed point
+    if not placements:
+        return {"used_length": 0.0, "utilization": 0.0}
+    fabric_min_x, fabric_min_y, _, fabric_max_y = Polygon(fabric_vertices).bounds
+    used_length = max(x for placement in placements for x, _ in placement.vertices) - fabric_min_x
+    pieces_area = sum(Polygon(placement.vertices).area for placement in placements)
+    used_area = used_length * (fabric_max_y - fabric_min_y)
+    return {"used_length": round(used_length, 2), "utilization": round(pieces_area / used_area, 4) if used_area else 0.0}
+
+
+def add_nesting_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--fabric-length", type=float, default=200, help="fabric size along x (cm)")
+    parser.add_argument("--fabric-width", type=float, default=150, help="fabric size along y (cm)")
+    parser.add_argument("--stripe-spacing", type=int, default=STRIPE_SPACING)
+    parser.add_argument("--no-stripes", action="store_true", help="place on the feasible region's corners instead of on stripes")
+    parser.add_argument("--engine", choices=NFP_ENGINES, default="orbital")
+    parser.add_argument("--kernel", choices=NFP_KERNELS, default="float")
+    parser.add_argument("--no-merge", action="store_true", help="don't merge pieces that share a seam line")
+    parser.add_argument("--lattice", type=float, nargs=4, metavar=("AX", "AY", "BX", "BY"),
+                        help="plaid repeat vectors, pieces go onto the lattice points instead of stripes")
+    parser.add_argument("--match-seams", action="store_true", help="place pieces on the stripe (or lattice) phase that continues the fabric across their seams")
+
+
+def nester_options(args: argparse.Namespace, pattern: Pattern = None) -> dict:
+    # Nester keyword arguments from the command line, the seam phases need the pattern
+    lattice = (tuple(args.lattice[:2]), tuple(args.lattice[2:])) if args.lattice else None
+    stripe_phases, lattice_phases = None, None
+    if args.match_seams and pattern is not None:
+        if lattice:
+            lattice_phases, _ = seam_lattice_phases(pattern, lattice)
+        else:
+            stripe_phases, _ = seam_stripe_phases(pattern, args.stripe_spacing)
+    return {
+        "fabric_vertices": fabric_rectangle(args.fabric_length, args.fabric_width), "stripe_spacing": args.stripe_spacing,
+        "stripes": not args.no_stripes, "engine": args.engine, "kernel": args.kernel, "stripe_phases": stripe_phases,
+        "lattice": lattice, "lattice_phases": lattice_phases,
+    }
+
+
+def nester_from_args(args: argparse.Namespace, executor=None, pattern: Pattern = None) -> Nester:
+    return Nester(**nester_options(args, pattern), executor=executor)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Nest the pieces of an SVG pattern onto a rectangular fabric, without the GUI.")
+    parser.add_argument("svg_file", nargs="?", help="not needed with --resume")
+    add_nesting_arguments(parser)
+    parser.add_argument("--rotations", type=float, nargs="+", default=[0], help=f"allowed piece rotations (degrees), {list(GRAIN_ROTATIONS)} keeps the grain line")
+    parser.add_argument("--mirror", action="store_true", help="pieces may also be cut mirrored")
+    parser.add_argument("--executor", choices=[kind for kind in EXECUTOR_KINDS if kind], default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--nfp-store", help="persistent NFP store, checkpoints refer to it")
+    parser.add_argument("--deadline", type=float, default=None, help="seconds, the pieces left then are placed by a quick raster fallback, refine them with --resume")
+    parser.add_argument("--checkpoint", help="keep writing the nesting state to this file")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="seconds between checkpoints")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="continue from a checkpoint, the nesting options are taken from it")
+    parser.add_argument("--output", help="write the placements to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the debug output of the NFP computation")
+    args = parser.parse_args(argv)
+    if not args.svg_file and not args.resume:
+        parser.error("either svg_file or --resume is needed")
+    return args
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    if args.nfp_store:
+        default_cache.store = NfpStore(args.nfp_store)
+    debug_output = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(debug_output):
+        if args.resume:
+            nester, pieces = Nester.from_checkpoint(args.resume, executor=make_executor(args.executor, args.workers))
+        else:
+            pattern = load_pattern(args.svg_file, merge_pieces=not args.no_merge)
+            for piece in pattern.pieces:
+                piece.orientations = allowed_orientations(args.rotations, args.mirror)
+            nester, pieces = nester_from_args(args, make_executor(args.executor, args.workers), pattern), pattern.pieces
+        nester.fit_all(pieces, args.deadline, args.checkpoint or args.resume, args.checkpoint_interval)
+
+    placements = nester.placements + nester.fallback_placements
+    for placement in placements:
+        print(f"{placement.name}: translated by ({placement.translation[0]:.2f}, {placement.translation[1]:.2f})")
+    print(marker_stats(placements, nester.fabric_vertices))
+    print(nester.cache)
+    print("NFP engine usage:", dict(engine_usage))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump([asdict(placement) for placement in placements], output_file, indent=2)
+    if nester.used_fallback:
+        print(f"Deadline reached, {len(nester.remaining)} pieces were placed by the raster fallback ({', '.join(piece.name for piece in nester.remaining)})"
+              + (f", --resume {args.checkpoint or args.resume} places them properly" if args.checkpoint or args.resume else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,8 @@
 from itertools import product
+from collections import Counter
+from concurrent.futures import Executor
+
+import numpy as np
 
 from shapely import set_precision, orient_polygons
 from shapely.geometry import Polygon
@@ -6,13 +10,175 @@ from shapely.affinity import translate
 
 import helper as helper
 from helper import EdgePair, INTERSECTION_PRECISION, NO_OF_ROUNDING_DIGITS
+from minkowski import convex_nfp, decomposition_nfp, rectangle_nfp, cached_classify_shape
+from fixed_point import fixed_convex_nfp, fixed_decomposition_nfp, ccw_units, is_convex_units, fixed_classify_edge_pair, fixed_is_left_or_right, fixed_feasibility_matrix, quantize, dequantize, points_equal
+from nfp_cache import NfpCache, nfp_key, local_frame
+from orientation import IDENTITY, orientation_matrix, inverse, orient_polygon, orient_vertices
+from orbit_state import OrbitPolygon, local_intersection, expected_contacts
+
+NFP_ENGINES = ("orbital", "decomposition")
+NFP_KERNELS = ("float", "fixed")  # fixed: quantized once to int64 grid units, exact from there (the orbital engine only classifies edges exactly)
+engine_usage = Counter()  # route -> number of NFPs it computed (cache hits not included), see route_nfp()
+CONTACT_CHECK_INTERVAL = 10  # every n-th orbit step the contacts come from a full intersection, as a consistency check
 
 a_poly_local = Polygon([(9, 5), (8, 8), (5, 6)])          # static, both anti-clockwise
 b_poly_untranslated_local = Polygon([(14, 6), (16, 8), (20, 6), (22, 12), (16, 10)])  # orbiting
 
-def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None) -> Polygon:
-    a_poly = orient_polygons(set_precision(a_poly_raw, INTERSECTION_PRECISION))
-    a_poly_edges = helper.get_edges(a_poly)
+def check_nfp_mode(engine: str, kernel: str) -> None:
+    if engine not in NFP_ENGINES:
+        raise ValueError(f"Unknown NFP engine: {engine}, expected one of {NFP_ENGINES}")
+    if kernel not in NFP_KERNELS:
+        raise ValueError(f"Unknown NFP kernel: {kernel}, expected one of {NFP_KERNELS}")
+
+
+def cache_engine(engine: str, kernel: str) -> str:
+    # fixed-kernel NFPs are cached separately, float keys stay what they were before there was a choice
+    return engine if kernel == "float" else f"{engine}/{kernel}"
+
+
+def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None, engine: str = "orbital", cache: NfpCache = None, kernel: str = "float") -> Polygon:
+    check_nfp_mode(engine, kernel)
+    key = nfp_key(a_poly_raw, b_poly_untranslated, cache_engine(engine, kernel)) if cache is not None else None
+    if cache is not None:
+        cached_nfp = cache.get(key, a_poly_raw)
+        if cached_nfp is not None:
+            return cached_nfp
+
+    route = route_nfp(a_poly_raw, b_poly_untranslated, engine, kernel)
+    engine_usage[route] += 1
+    nfp_poly = compute_routed_nfp(route, a_poly_raw, b_poly_untranslated, reference_point)
+    if cache is not None:
+        cache.put(key, a_poly_raw, nfp_poly)
+    return nfp_poly
+
+
+def nfps(a_polys: list, b_poly_untranslated: Polygon, reference_point=None, engine: str = "orbital", cache: NfpCache = None, kernel: str = "float", executor: Executor = None) -> list:
+    """
+    NFPs of one orbiting piece against several static ones, in the same order as a_polys.
+    They are independent of each other, so the ones that aren't cached get computed on the executor (if there is one).
+    The cache is only touched from the calling thread/process, workers just compute.
+    """
+    if executor is None:
+        return [nfp(a_poly, b_poly_untranslated, reference_point, engine, cache, kernel) for a_poly in a_polys]
+    check_nfp_mode(engine, kernel)
+
+    keys = [nfp_key(a_poly, b_poly_untranslated, cache_engine(engine, kernel)) for a_poly in a_polys] if cache is not None else [None] * len(a_polys)
+    results = [cache.get(key, a_poly) if cache is not None else None for key, a_poly in zip(keys, a_polys)]
+    futures = {}
+    for index, result in enumerate(results):
+        if result is None:
+            route = route_nfp(a_polys[index], b_poly_untranslated, engine, kernel)
+            engine_usage[route] += 1  # counted here, counters in worker processes would get lost
+            futures[index] = executor.submit(compute_routed_nfp, route, a_polys[index], b_poly_untranslated, reference_point)
+    for index, future in futures.items():
+        results[index] = future.result()
+        if cache is not None:
+            cache.put(keys[index], a_polys[index], results[index])
+    return results
+
+
+def __in_frame(polygon: Polygon, orientation: tuple) -> Polygon:
+    # rounded like piece vertices: top vertices that tie keep tying (cached NFPs rely on which one B's is) and cache keys match
+    return Polygon(orient_vertices(list(polygon.exterior.coords)[:-1], orientation, NO_OF_ROUNDING_DIGITS))
+
+
+def oriented_nfps(a_polys: list, a_orientations: list, b_poly_untranslated: Polygon, reference_point=None, engine: str = "orbital",
+                  cache: NfpCache = None, kernel: str = "float", executor: Executor = None) -> list:
+    """
+    Like nfps, for static pieces that were placed in some orientation (see orientation.py) and an orbiting piece in any orientation.
+    NFPs are computed in the frame of the static piece's orientation M and turned back: NFP(M a, b) = M NFP(a, M^-1 b).
+    - a piece placed in the same orientation as the orbiting one gives the NFP of the two unrotated pieces, which is
+      what the cache already holds (keys don't depend on the position), so each relative orientation is only computed once
+    - static pieces are grouped by orientation, every group is one nfps call (on the executor, if there is one)
+    Returned NFPs track the orbiting piece's top vertex, like the ones nfps returns.
+    """
+    groups = {}
+    for index, a_orientation in enumerate(a_orientations):
+        groups.setdefault(tuple(a_orientation), []).append(index)
+
+    results = [None] * len(a_polys)
+    pt_b_ymax = np.array(max(b_poly_untranslated.exterior.coords, key=lambda p: p[1]))
+    for a_orientation, indices in groups.items():
+        if a_orientation == IDENTITY:
+            group_nfps = nfps([a_polys[index] for index in indices], b_poly_untranslated, reference_point, engine, cache, kernel, executor)
+            for index, group_nfp in zip(indices, group_nfps):
+                results[index] = group_nfp
+            continue
+
+        to_frame = inverse(a_orientation)
+        b_in_frame = __in_frame(b_poly_untranslated, to_frame)
+        reference_in_frame = tuple(orientation_matrix(to_frame) @ reference_point) if reference_point is not None else None
+        frame_nfps = nfps([__in_frame(a_polys[index], to_frame) for index in indices], b_in_frame, reference_in_frame, engine, cache, kernel, executor)
+
+        # the NFP in the frame tracks the top vertex of the turned B, which isn't necessarily B's top vertex any more
+        tracked = orientation_matrix(a_orientation) @ np.array(max(b_in_frame.exterior.coords, key=lambda p: p[1]))
+        dx, dy = pt_b_ymax - tracked
+        for index, frame_nfp in zip(indices, frame_nfps):
+            results[index] = set_precision(translate(orient_polygon(frame_nfp, a_orientation), xoff=dx, yoff=dy), INTERSECTION_PRECISION)
+    return results
+
+
+def compute_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point, engine: str, kernel: str = "float") -> Polygon:
+    return compute_routed_nfp(route_nfp(a_poly_raw, b_poly_untranslated, engine, kernel), a_poly_raw, b_poly_untranslated, reference_point)
+
+
+def route_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, engine: str, kernel: str = "float") -> str:
+    # the cheapest exact engine for the pair, the requested engine is only needed when one of them is concave
+    if kernel == "fixed":
+        # convexity is decided exactly on the quantized pieces, so there are no tolerance-driven edge cases
+        if is_convex_units(ccw_units(a_poly_raw)) and is_convex_units(ccw_units(b_poly_untranslated)):
+            return "fixed/convex"
+        return f"fixed/{engine}"
+
+    shape_classes = {cached_classify_shape(a_poly_raw), cached_classify_shape(b_poly_untranslated)}
+    if shape_classes == {"rectangle"}:
+        return "rectangle"
+    if "general" not in shape_classes:
+        return "convex"  # Minkowski sum, no orbiting needed
+    return engine
+
+
+def compute_routed_nfp(route: str, a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point) -> Polygon:
+    # computed in the local frames the cache keys use and moved back onto A, so the result only depends on the shapes:
+    # the orbital engine's exact touching tests succeeded or failed depending on where A happened to sit
+    a_coords, (dx, dy) = local_frame(a_poly_raw)
+    b_coords, (b_x, b_y) = local_frame(b_poly_untranslated)
+    local_reference = (reference_point[0] - b_x, reference_point[1] - b_y) if reference_point is not None else None
+    local_nfp = compute_local_nfp(route, Polygon(a_coords), Polygon(b_coords), local_reference)
+    return set_precision(translate(local_nfp, xoff=dx, yoff=dy), INTERSECTION_PRECISION)
+
+
+def compute_local_nfp(route: str, a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point) -> Polygon:
+    match route:
+        case "rectangle":
+            return rectangle_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "convex":
+            return convex_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "decomposition":
+            return decomposition_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "orbital":
+            return orbital_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "fixed/convex":
+            return fixed_convex_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "fixed/decomposition":
+            return fixed_decomposition_nfp(a_poly_raw, b_poly_untranslated, reference_point)
+        case "fixed/orbital":
+            return orbital_nfp(a_poly_raw, b_poly_untranslated, reference_point, kernel="fixed")
+        case _:
+            raise ValueError(f"Unknown NFP route: {route}")
+
+
+def orbital_nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None, kernel: str = "float") -> Polygon:
+    # with the fixed kernel, A and B are quantized once and their int64 grid units are the orbit's state: touching edge pairs
+    # are classified and all side tests decided exactly on them. a move is still trimmed on the coordinates derived from
+    # the units, the trimmed move is rounded to whole units once and added to B's units
+    fixed = kernel == "fixed"
+    if fixed:
+        a_orbit = OrbitPolygon.from_polygon(orient_polygons(a_poly_raw), quantized=True)
+        a_poly = a_orbit.polygon
+    else:
+        a_poly = orient_polygons(set_precision(a_poly_raw, INTERSECTION_PRECISION))
+        a_orbit = OrbitPolygon.from_polygon(a_poly)  # the orbit works on coordinate arrays, shapely objects are built on demand
     # 1. setup
     # TODO more advanced version where you give a reference point and then try to find a touching, non-intersecting position for b_poly
     # find lowest y point of A pt_a_ymin
@@ -26,17 +192,27 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
     # translate B with trans: B->A = pt_a_ymin - pt_b_ymax
     dx = pt_a_ymin[0] - pt_b_ymax[0]
     dy = pt_a_ymin[1] - pt_b_ymax[1]
-    b_poly = orient_polygons(translate(b_poly_untranslated, xoff=dx, yoff=dy))
-    b_poly_edges = helper.get_edges(b_poly)
+    if fixed:  # whole units, so B's top vertex lands exactly on pt_a_ymin. the NFP is read off that vertex
+        b_orbit = OrbitPolygon.from_polygon(orient_polygons(b_poly_untranslated), quantized=True)
+        b_orbit = b_orbit.translated(dequantize(quantize(pt_a_ymin) - quantize(pt_b_ymax)))
+        b_poly = b_orbit.polygon
+        reference_index = np.flatnonzero(points_equal(b_orbit.units, quantize(pt_a_ymin)))[0]
+    else:
+        # onto A's grid: B's top vertex has to land exactly on pt_a_ymin, float error in dx / dy would make them overlap a tiny bit
+        b_poly = orient_polygons(set_precision(translate(b_poly_untranslated, xoff=dx, yoff=dy), INTERSECTION_PRECISION, mode="pointwise"))
+        b_orbit = OrbitPolygon.from_polygon(b_poly)
 
     if not a_poly.touches(b_poly):
         raise Exception("Polygons need to touch at the start")
 
     nfp_is_closed_loop = False
+    intersection = None
+    steps = 0
     while not nfp_is_closed_loop:
         shared_points = []
         line_intersection_flag = False
-        intersection = helper.precision_aware_intersection(a_poly, b_poly)
+        if intersection is None or intersection.is_empty:
+            intersection = helper.precision_aware_intersection(a_orbit.polygon, b_orbit.polygon)
         if intersection.is_empty:
             raise Exception("Polygons are not touching")
 
@@ -51,10 +227,10 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
         # store these touching pairs, along with the position of the touching vertex
         # at the current step, this should leave us with 4 pairs, even in the case of identical edges
 
-        combinations = {}
+        combinations = {}  # shared point -> pairs of (edge index of A, edge index of B)
         for shared_point in shared_points:
-            edges_poly_a = helper.incident_edges(a_poly, shared_point)
-            edges_poly_b = helper.incident_edges(b_poly, shared_point)
+            edges_poly_a = a_orbit.incident_edges(shared_point)
+            edges_poly_b = b_orbit.incident_edges(shared_point)
             combinations[shared_point] = list(product(edges_poly_a, edges_poly_b))
 
         print("identified edge pair combinations: ", combinations)
@@ -65,12 +241,16 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
         # (3) stationary edge touches the middle of orbiting edge (also like a T)
 
         touching_pairs = []
-        for shared_point, edge_pair_list in combinations.items():
-            for edge_pair in edge_pair_list:
-                edge_case = helper.classify_edge_pair(edge_pair, shared_point)
-                edge_a_index = helper.find_edge_index(a_poly_edges, edge_pair[0])
-                edge_b_index = helper.find_edge_index(b_poly_edges, edge_pair[1])
-                touching_pairs.append(EdgePair(edge_pair[0], edge_a_index, edge_pair[1], edge_b_index, shared_point, edge_case))
+        for shared_point, edge_index_pairs in combinations.items():
+            shared_units = quantize(shared_point.coords[0]) if fixed else None
+            for edge_a_index, edge_b_index in edge_index_pairs:
+                edge_pair = (a_orbit.edge(edge_a_index), b_orbit.edge(edge_b_index))
+                if fixed:
+                    units = np.concatenate((a_orbit.edge_units(edge_a_index), b_orbit.edge_units(edge_b_index), [shared_units]))
+                    edge_case = fixed_classify_edge_pair(units)
+                else:
+                    units, edge_case = None, helper.classify_edge_pair(edge_pair, shared_point)
+                touching_pairs.append(EdgePair(edge_pair[0], int(edge_a_index), edge_pair[1], int(edge_b_index), shared_point, edge_case, units))
 
         # 2b) create potential translation vectors
         # create translation vectors from these pairs
@@ -86,7 +266,7 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
         for pair in touching_pairs:
             match pair.edge_case:
                 case 1:
-                    translation, edge = helper.translation_vector_from_edge_pair(pair)
+                    translation, edge = helper.translation_vector_from_edge_pair(pair, fixed_is_left_or_right if fixed else None)
                 case 2:
                     translation = helper.vector_from_points((pair.shared_vertex.x, pair.shared_vertex.y), pair.edge_a.coords[1])
                     edge = ("a", pair.edge_a_index)
@@ -118,12 +298,11 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
 
         feasible_translation_vectors = []
         feasible_translation_vectors_edges = []
-        for index, translation_vector in enumerate(potential_translation_vectors):
-            is_feasible = True
-            for pair in touching_pairs:
-                is_feasible = is_feasible and helper.is_in_feasible_range(translation_vector, pair)  # stops checking once an edge has been found not feasible
-            if is_feasible:
-                feasible_translation_vectors.append(translation_vector)
+        if potential_translation_vectors:
+            feasibility_matrix = fixed_feasibility_matrix if fixed else helper.feasibility_matrix
+            is_feasible = feasibility_matrix(potential_translation_vectors, touching_pairs).all(axis=1)  # all vectors against all pairs at once
+            for index in np.flatnonzero(is_feasible):
+                feasible_translation_vectors.append(potential_translation_vectors[index])
                 feasible_translation_vectors_edges.append(potential_translation_vectors_edges[index])
 
         print("feasible translation vectors: ", feasible_translation_vectors)
@@ -143,8 +322,8 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
             actually_feasible_vectors_edges = []
             if not line_intersection_flag:
                 for index, candidate in enumerate(feasible_translation_vectors):
-                    b_poly_candidate = translate(b_poly, xoff=candidate[0], yoff=candidate[1])
-                    if not helper.precision_aware_intersection(a_poly, b_poly_candidate).is_empty:
+                    b_poly_candidate = b_orbit.translated(candidate, snapped=False).polygon
+                    if not helper.precision_aware_intersection(a_orbit.polygon, b_poly_candidate).is_empty:
                         actually_feasible_vectors.append(candidate)
                         actually_feasible_vectors_edges.append(feasible_translation_vectors_edges[index])
                 if len(actually_feasible_vectors) > 1:
@@ -182,28 +361,43 @@ def nfp(a_poly_raw: Polygon, b_poly_untranslated: Polygon, reference_point=None)
         # for all points of B, apply the translation and see if (and where) it intersects
         # for all points of A, apply the translation "backwards" and see if (and where) it intersects
         # trim translation vector as you go
-        # TODO this can be used to eliminate intersection tests
+        # wherever the trimming stopped, A and B will touch after the move
 
-        trimmed_translation_vector = helper.trim_translation_vector(b_poly, a_poly, untrimmed_translation, shared_points, intersection)
-        trimmed_translation_vector = helper.trim_translation_vector(a_poly, b_poly, trimmed_translation_vector, shared_points, intersection, reverse=True)
+        trimmed_translation_vector, forward_contact = helper.trim_translation_vector(b_orbit.coords, a_orbit.coords, untrimmed_translation, shared_points, intersection)
+        trimmed_translation_vector, reverse_contact = helper.trim_translation_vector(a_orbit.coords, b_orbit.coords, trimmed_translation_vector, shared_points, intersection, reverse=True)
+        new_contacts = [contact for contact in (forward_contact, reverse_contact) if contact is not None]
+        if fixed:
+            trimmed_translation_vector = tuple(dequantize(quantize(trimmed_translation_vector)).tolist())  # the one rounding of the move
         print("trimmed translation vector: ", trimmed_translation_vector)
 
         if trimmed_translation_vector[0] == 0 and trimmed_translation_vector[1] == 0:
             raise Exception("Translation vector (0,0) is not allowed")
 
         # 2e) apply feasible translation
-        b_poly_imprecise = translate(b_poly, xoff=trimmed_translation_vector[0], yoff=trimmed_translation_vector[1])
-        b_poly = orient_polygons(set_precision(b_poly_imprecise, INTERSECTION_PRECISION))
-        b_poly_edges = helper.get_edges(b_poly)
-        nfp.append((round(nfp[-1][0] + trimmed_translation_vector[0], NO_OF_ROUNDING_DIGITS), round(nfp[-1][1] + trimmed_translation_vector[1], NO_OF_ROUNDING_DIGITS)))
+        b_orbit = b_orbit.translated(trimmed_translation_vector)  # snapped to the same grid set_precision would use
+        if fixed:
+            nfp.append(tuple(b_orbit.coords[reference_index].tolist()))
+        else:
+            nfp.append((round(nfp[-1][0] + trimmed_translation_vector[0], NO_OF_ROUNDING_DIGITS), round(nfp[-1][1] + trimmed_translation_vector[1], NO_OF_ROUNDING_DIGITS)))
         nfp_edges.append(untrimmed_translation_edge)
 
         print("NFP: ", nfp)
         nfp_is_closed_loop = helper.is_closed_loop(nfp)
+        if nfp_is_closed_loop:
+            nfp[-1] = nfp[0]  # don't overshoot the start
 
         if len(nfp) > 100:  # safety mechanism
             nfp_is_closed_loop = True
 
+        # 2f) next contact set
+        # B can only touch A where they touched before (on either side of the move) or where the trimming stopped,
+        # so only the edges around those get intersected. empty/None falls back to the full intersection above
+        steps += 1
+        if steps % CONTACT_CHECK_INTERVAL:
+            intersection = local_intersection(a_orbit, b_orbit, expected_contacts(intersection, trimmed_translation_vector, new_contacts))
+        else:
+            intersection = None
+
     is_valid = False
     while not is_valid:
         if not nfp:
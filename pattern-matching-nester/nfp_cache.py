@@ -0,0 +1,91 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from shapely import set_precision
+from shapely.geometry import Polygon
+from shapely.affinity import translate
+
+from helper import INTERSECTION_PRECISION, NO_OF_ROUNDING_DIGITS
+from nfp_store import NfpStore
+
+NFP_CACHE_SIZE = 1024  # number of NFPs kept in memory
+
+
+def local_frame(polygon: Polygon) -> tuple:
+    # coordinates relative to the first vertex, plus that vertex (= where the local frame sits right now)
+    coords = np.asarray(polygon.exterior.coords, dtype=float)[:-1]
+    origin = coords[0]
+    local_coords = np.round(coords - origin, NO_OF_ROUNDING_DIGITS) + 0.0  # + 0.0 gets rid of -0.0, which hashes differently
+    return local_coords, (float(origin[0]), float(origin[1]))
+
+
+def nfp_key(a_poly: Polygon, b_poly: Polygon, engine: str = "orbital", rotation: float = 0) -> str:
+    # the NFP only depends on the shapes, not on where A and B currently are:
+    # moving A moves the NFP along with it, and the NFP tracks a vertex of B itself
+    digest = hashlib.blake2b(digest_size=16)
+    for polygon in (a_poly, b_poly):
+        local_coords, _ = local_frame(polygon)
+        digest.update(len(local_coords).to_bytes(4, "little"))
+        digest.update(local_coords.tobytes())
+    digest.update(f"{engine}|{rotation}".encode())
+    return digest.hexdigest()
+
+
+class NfpCache():
+    def __init__(self, max_size: int = NFP_CACHE_SIZE, store: NfpStore = None):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> NFP in the local frame of A, least recently used first
+        self.store = store  # optional on-disk backend, shared with other processes
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"NFP cache: {len(self)}/{self.max_size} entries, {self.hits} hits ({self.store_hits} from store), {self.misses} misses"
+
+    def get(self, key: str, a_poly: Polygon) -> Polygon | None:
+        local_nfp = self.entries.get(key)
+        if local_nfp is None and self.store is not None:
+            local_nfp = self.store.get(key)
+            if local_nfp is not None:
+                self.store_hits += 1
+                self.__remember(key, local_nfp)
+        if local_nfp is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        _, (dx, dy) = local_frame(a_poly)
+        return set_precision(translate(local_nfp, xoff=dx, yoff=dy), INTERSECTION_PRECISION)
+
+    def put(self, key: str, a_poly: Polygon, nfp_poly: Polygon) -> None:
+        _, (dx, dy) = local_frame(a_poly)
+        self.put_local(key, translate(nfp_poly, xoff=-dx, yoff=-dy))
+
+    def put_local(self, key: str, local_nfp: Polygon) -> None:
+        # for NFPs that are already in the local frame of A
+        self.__remember(key, local_nfp)
+        if self.store is not None:
+            self.store.put(key, local_nfp)
+
+    def __remember(self, key: str, local_nfp: Polygon) -> None:
+        self.entries[key] = local_nfp
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        # only forgets what is in memory, the store (if any) is persistent on purpose
+        self.entries.clear()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+
+default_cache = NfpCache()
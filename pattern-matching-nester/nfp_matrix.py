@@ -0,0 +1,125 @@
+import io
+import time
+import contextlib
+from dataclasses import dataclass, field
+from concurrent.futures import as_completed
+
+import numpy as np
+
+from shapely.geometry import Polygon
+from shapely.affinity import rotate
+
+from nfp import compute_nfp, check_nfp_mode, cache_engine
+from nfp_cache import NfpCache, nfp_key, local_frame
+from parallel import make_executor
+
+
+@dataclass
+class NfpMatrix:
+    """
+    NFPs of all ordered piece pairs x rotations, computed before nesting starts.
+    The rings of all NFPs sit in one flat coordinate buffer, each NFP in the local frame of its static piece:
+    - NFP n has the rings polygon_offsets[n] to polygon_offsets[n + 1]
+    - ring r has the points ring_offsets[r] to ring_offsets[r + 1]
+    """
+    coords: np.ndarray
+    ring_offsets: np.ndarray
+    polygon_offsets: np.ndarray
+    pairs: dict  # (static index, static rotation, orbiting index, orbiting rotation) -> NFP number
+    keys: dict  # same pairs -> NfpCache key
+    timings: dict = field(default_factory=dict)  # pair -> seconds, failed pairs included
+    failures: dict = field(default_factory=dict)  # pair -> error message, these have no NFP
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __str__(self):
+        return f"NFP matrix: {len(self)} NFPs, {len(self.failures)} failed, {len(self.coords)} points, {sum(self.timings.values()):.2f}s compute time"
+
+    def local_nfp(self, pair: tuple) -> Polygon | None:
+        if pair not in self.pairs:
+            return None
+        number = self.pairs[pair]
+        first_ring, last_ring = self.polygon_offsets[number], self.polygon_offsets[number + 1]
+        rings = [self.coords[self.ring_offsets[r]:self.ring_offsets[r + 1]] for r in range(first_ring, last_ring)]
+        return Polygon(rings[0], rings[1:])
+
+    def fill_cache(self, cache: NfpCache) -> None:
+        # from here on, placing only translates the precomputed NFPs
+        cache.max_size = max(cache.max_size, len(cache) + len(self))  # nothing precomputed should get evicted
+        for pair in self.pairs:
+            cache.put_local(self.keys[pair], self.local_nfp(pair))
+
+
+def rotated(vertices: list, rotation: float) -> Polygon:
+    # rotations are around the first vertex, the local frame doesn't care where the piece is anyway
+    polygon = Polygon(vertices)
+    return polygon if rotation == 0 else rotate(polygon, rotation, origin=vertices[0])
+
+
+def compute_pair(a_poly: Polygon, b_poly: Polygon, engine: str, kernel: str) -> tuple:
+    # runs in a worker: (local frame NFP rings or None, seconds, error message or None)
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the orbit is chatty
+            nfp_poly = compute_nfp(a_poly, b_poly, None, engine, kernel)
+        if nfp_poly.geom_type != "Polygon" or nfp_poly.is_empty:
+            raise Exception(f"NFP is a {nfp_poly.geom_type}, expected a non-empty Polygon")
+    except Exception as error:
+        return None, time.perf_counter() - start, f"{type(error).__name__}: {error}"
+
+    _, origin = local_frame(a_poly)
+    rings = [np.asarray(ring.coords, dtype=float) - origin for ring in [nfp_poly.exterior, *nfp_poly.interiors]]
+    return rings, time.perf_counter() - start, None
+
+
+def print_progress(done: int, total: int, pair: tuple, seconds: float, error: str | None) -> None:
+    status = f"FAILED ({error})" if error else "ok"
+    print(f"[{done}/{total}] NFP {pair}: {seconds:.3f}s {status}")
+
+
+def build_nfp_matrix(pieces: list, rotations: tuple = (0,), engine: str = "orbital", kernel: str = "float", workers: int = None, progress=print_progress) -> NfpMatrix:
+    """
+    Computes the NFP of every ordered pair of different pieces, for every combination of rotations, in a process pool.
+    Pairs that fail (the orbit still raises on some shapes) are reported and left out, they don't abort the run.
+    progress(done, total, pair, seconds, error) is called as pairs finish, pass None to stay quiet.
+    """
+    check_nfp_mode(engine, kernel)
+    polygons = {(piece.index, rotation): rotated(piece.vertices, rotation) for piece in pieces for rotation in rotations}
+    jobs = [(a_index, a_rotation, b_index, b_rotation)
+            for a_index, a_rotation in polygons for b_index, b_rotation in polygons if a_index != b_index]
+
+    keys = {}
+    results = {}
+    timings = {}
+    failures = {}
+    with make_executor("process", workers) as executor:
+        futures = {}
+        for pair in jobs:
+            a_poly, b_poly = polygons[pair[:2]], polygons[pair[2:]]
+            keys[pair] = nfp_key(a_poly, b_poly, cache_engine(engine, kernel))
+            futures[executor.submit(compute_pair, a_poly, b_poly, engine, kernel)] = pair
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            pair = futures[future]
+            rings, timings[pair], error = future.result()
+            if error:
+                failures[pair] = error
+            else:
+                results[pair] = rings
+            if progress:
+                progress(done, len(jobs), pair, timings[pair], error)
+
+    # flatten in job order, so the layout doesn't depend on which worker finished first
+    pairs = {}
+    all_rings = []
+    polygon_offsets = [0]
+    for pair in jobs:
+        if pair in results:
+            pairs[pair] = len(pairs)
+            all_rings.extend(results[pair])
+            polygon_offsets.append(len(all_rings))
+    ring_offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in all_rings], dtype=np.int64)))
+    coords = np.concatenate(all_rings) if all_rings else np.empty((0, 2))
+
+    return NfpMatrix(coords, ring_offsets, np.asarray(polygon_offsets, dtype=np.int64), pairs, keys, timings, failures)
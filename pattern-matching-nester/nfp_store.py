@@ -0,0 +1,167 @@
+import os
+import mmap
+import time
+import struct
+
+import numpy as np
+
+from shapely.geometry import Polygon
+
+if os.name == "nt":  # there is no fcntl on Windows, and nfp -> nfp_cache -> nfp_store is on every import path
+    import msvcrt
+else:
+    import fcntl
+
+# file layout: MAGIC, then records appended back to back, each one being
+#   header (key digest, number of rings, number of points)
+#   ring sizes as uint32, padded to 8 bytes
+#   points as little-endian float64 x/y pairs, exterior ring first, then the holes
+MAGIC = b"NFPSTOR1"
+RECORD_HEADER = struct.Struct("<16sII")
+LOCK_TIMEOUT = 30  # seconds a writer waits for the lock before giving up
+
+
+def record_size(n_rings: int, n_points: int) -> int:
+    ring_sizes_length = 4 * n_rings + (-(4 * n_rings) % 8)
+    return RECORD_HEADER.size + ring_sizes_length + 16 * n_points
+
+
+def pack_record(digest: bytes, polygon: Polygon) -> bytes:
+    rings = [np.asarray(ring.coords, dtype="<f8") for ring in [polygon.exterior, *polygon.interiors]]
+    ring_sizes = np.array([len(ring) for ring in rings], dtype="<u4")
+    padding = b"\0" * (-(4 * len(rings)) % 8)
+    return RECORD_HEADER.pack(digest, len(rings), int(ring_sizes.sum())) + ring_sizes.tobytes() + padding + np.concatenate(rings).tobytes()
+
+
+class NfpStore():
+    """
+    Persistent, append-only NFP store that can be shared between processes.
+    - readers map the file and never lock, they only ever look at complete records
+    - writers append a record while holding an exclusive lock on <path>.lock
+    Keys are the hex digests NfpCache uses, NFPs are stored in the local frame of the static piece.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.index = {}  # key digest -> record offset
+        self.indexed_size = len(MAGIC)
+        self.mapping = None
+        self.mapped_size = 0
+
+        if not os.path.exists(path):
+            with _FileLock(self.lock_path):
+                if not os.path.exists(path):
+                    with open(path, "wb") as store_file:
+                        store_file.write(MAGIC)
+        self.refresh()
+
+    def __len__(self):
+        return len(self.index)
+
+    def refresh(self) -> None:
+        # pick up records that other processes appended since the file was last mapped
+        size = os.path.getsize(self.path)
+        if size == self.mapped_size or size < len(MAGIC):
+            return
+        if size < self.mapped_size:  # a torn record was cut off, start over
+            self.index = {}
+            self.indexed_size = len(MAGIC)
+
+        if self.mapping is not None:
+            self.mapping.close()  # get() copies out of the mapping, nothing else holds on to it
+        with open(self.path, "rb") as store_file:
+            self.mapping = mmap.mmap(store_file.fileno(), size, access=mmap.ACCESS_READ)
+        self.mapped_size = size
+        if self.mapping[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not an NFP store: {self.path}")
+
+        offset = self.indexed_size
+        while offset + RECORD_HEADER.size <= self.mapped_size:
+            digest, n_rings, n_points = RECORD_HEADER.unpack_from(self.mapping, offset)
+            end = offset + record_size(n_rings, n_points)
+            if end > self.mapped_size:
+                break  # still being written (or torn)
+            self.index.setdefault(digest, offset)
+            offset = end
+        self.indexed_size = offset
+
+    def get(self, key: str) -> Polygon | None:
+        digest = bytes.fromhex(key)
+        if digest not in self.index:
+            self.refresh()
+            if digest not in self.index:
+                return None
+
+        offset = self.index[digest]
+        _, n_rings, n_points = RECORD_HEADER.unpack_from(self.mapping, offset)
+        ring_sizes = np.frombuffer(self.mapping, dtype="<u4", count=n_rings, offset=offset + RECORD_HEADER.size)
+        points_offset = offset + record_size(n_rings, 0)
+        points = np.frombuffer(self.mapping, dtype="<f8", count=2 * n_points, offset=points_offset).reshape(-1, 2)  # no copy, reads straight from the mapping
+
+        rings = np.split(points, np.cumsum(ring_sizes)[:-1])
+        return Polygon(rings[0], rings[1:])
+
+    def put(self, key: str, nfp_poly: Polygon) -> None:
+        if nfp_poly.is_empty or nfp_poly.geom_type != "Polygon":
+            return
+        digest = bytes.fromhex(key)
+        record = pack_record(digest, nfp_poly)
+
+        with _FileLock(self.lock_path):
+            self.refresh()
+            if digest in self.index:
+                return  # another worker got there first
+
+            if self.indexed_size < os.path.getsize(self.path):
+                # only a writer that died mid-append leaves a partial record, and nobody else is writing right now
+                self.mapping.close()  # Windows can't truncate a mapped file, refresh() maps it again below
+                self.mapping, self.mapped_size = None, 0
+                try:
+                    os.truncate(self.path, self.indexed_size)
+                except PermissionError:
+                    if os.name != "nt":
+                        raise
+                    return  # another process still maps the file, it's only a cache, the next put tries again
+
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, record)
+            finally:
+                os.close(fd)
+        self.refresh()
+
+
+class _FileLock():
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.path, "a")
+        if os.name == "nt":  # locks the first byte, that works on an empty file too
+            self.lock_windows()
+        else:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def lock_windows(self) -> None:
+        # LK_LOCK gives up after 10 tries a second apart, poll LK_NBLCK instead with our own timeout
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            self.lock_file.seek(0)
+            try:
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.lock_file.close()
+                    raise TimeoutError(f"Couldn't lock {self.path} within {LOCK_TIMEOUT}s")
+                time.sleep(0.01)
+
+    def __exit__(self, *exc_info):
+        if os.name == "nt":
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
@@ -0,0 +1,132 @@
+import numpy as np
+
+from shapely.geometry import Polygon, LineString, MultiLineString, Point
+
+from helper import INTERSECTION_PRECISION, snap, precision_aware_intersection
+from fixed_point import quantize, dequantize
+
+CONTACT_WINDOW = 2 * INTERSECTION_PRECISION  # how far around an expected contact edges are considered
+
+
+def without_repeated_vertices(coords: np.ndarray) -> np.ndarray:
+    # like minkowski.ccw_vertices(): repeated vertices produce zero-length edges, which have no direction to classify
+    edges = np.roll(coords, -1, axis=0) - coords
+    return coords[np.any(edges != 0, axis=1)]
+
+
+class OrbitPolygon():
+    """
+    Polygon state for the orbit in nfp.orbital_nfp(): a coordinate array plus an edge index table.
+    Edge i runs from coords[edge_starts[i]] to coords[edge_ends[i]], same order as the polygon's exterior.
+    Translating only adds a vector to the coordinates, the edge table is shared between all positions.
+    For the fixed-point kernel the polygon is quantized once and the int64 grid units are the state: moves are added to
+    them exactly, coords are only derived from them.
+    """
+    def __init__(self, coords: np.ndarray, edge_starts: np.ndarray = None, edge_ends: np.ndarray = None, units: np.ndarray = None):
+        self.coords = coords  # anti-clockwise ring, without closing point
+        self.edge_starts = np.arange(len(coords)) if edge_starts is None else edge_starts
+        self.edge_ends = np.roll(self.edge_starts, -1) if edge_ends is None else edge_ends
+        self.units = units  # fixed-point kernel only, same ring as coords
+        self.__polygon = None
+
+    @classmethod
+    def from_polygon(cls, polygon: Polygon, quantized: bool = False) -> "OrbitPolygon":
+        coords = np.asarray(polygon.exterior.coords, dtype=float)[:-1]
+        if quantized:
+            units = without_repeated_vertices(quantize(coords))
+            return cls(dequantize(units), units=units)
+        return cls(without_repeated_vertices(coords))
+
+    def translated(self, vector: tuple, snapped: bool = True) -> "OrbitPolygon":
+        if self.units is not None:  # integer moves can't make vertices meet, and there is nothing to snap
+            units = self.units + quantize(vector)
+            return OrbitPolygon(dequantize(units), self.edge_starts, self.edge_ends, units)
+        coords = self.coords + np.asarray(vector, dtype=float)
+        if not snapped:
+            return OrbitPolygon(coords, self.edge_starts, self.edge_ends)
+        # snapping can pull neighbours that were less than a grid cell apart onto the same point
+        snapped_coords = snap(coords)
+        unique_coords = without_repeated_vertices(snapped_coords)
+        if len(unique_coords) < len(snapped_coords):
+            return OrbitPolygon(unique_coords)  # fewer edges, so the edge table is rebuilt
+        return OrbitPolygon(snapped_coords, self.edge_starts, self.edge_ends)
+
+    @property
+    def polygon(self) -> Polygon:
+        # only built when shapely is actually needed, and then only once per position
+        if self.__polygon is None:
+            self.__polygon = Polygon(self.coords)
+        return self.__polygon
+
+    def edge(self, index: int) -> LineString:
+        return LineString([self.coords[self.edge_starts[index]], self.coords[self.edge_ends[index]]])
+
+    def edge_units(self, index: int) -> np.ndarray:
+        return self.units[[self.edge_starts[index], self.edge_ends[index]]]
+
+    def incident_edges(self, point: Point, tol: float = INTERSECTION_PRECISION) -> np.ndarray:
+        # indices of all edges within tol of the point (Point-Edge intersection is too flaky, unfortunately)
+        starts = self.coords[self.edge_starts]
+        directions = self.coords[self.edge_ends] - starts
+        to_point = np.array([point.x, point.y]) - starts
+        squared_lengths = np.einsum("ij,ij->i", directions, directions)
+        t = np.clip(np.einsum("ij,ij->i", to_point, directions) / np.where(squared_lengths > 0, squared_lengths, 1), 0, 1)
+        distances = np.hypot(*(to_point - t[:, None] * directions).T)
+        return np.flatnonzero(distances <= tol)
+
+    def edge_bounds(self, indices: np.ndarray = None) -> tuple:
+        # lower and upper corners of the edges' bounding boxes
+        indices = slice(None) if indices is None else indices
+        starts = self.coords[self.edge_starts[indices]]
+        ends = self.coords[self.edge_ends[indices]]
+        return np.minimum(starts, ends), np.maximum(starts, ends)
+
+    def edges_near(self, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+        # indices of all edges whose bounding box overlaps at least one of the boxes (k, 2) lower/upper corners
+        edge_lower, edge_upper = self.edge_bounds()
+        overlaps = np.all((edge_lower[:, None, :] <= upper[None, :, :]) & (edge_upper[:, None, :] >= lower[None, :, :]), axis=2)
+        return np.flatnonzero(overlaps.any(axis=1))
+
+    def edge_lines(self, indices: np.ndarray) -> MultiLineString:
+        return MultiLineString([self.coords[[self.edge_starts[i], self.edge_ends[i]]] for i in indices])
+
+
+def local_intersection(a: OrbitPolygon, b: OrbitPolygon, segments: np.ndarray):
+    """
+    Intersection of A and B, but only looking at the edges around the given segments (k, 2, 2), where contacts are expected.
+    For touching polygons that is the same as intersecting the whole polygons, overlaps can't be detected this way though.
+    Returns None if there is nothing to intersect around the segments.
+    """
+    lower = segments.min(axis=1) - CONTACT_WINDOW
+    upper = segments.max(axis=1) + CONTACT_WINDOW
+    # a contact line that grows while sliding ends at a vertex of one of the edges it lies on,
+    # so the window is widened to all edges found around the expected contacts
+    (a_lower, a_upper), (b_lower, b_upper) = a.edge_bounds(a.edges_near(lower, upper)), b.edge_bounds(b.edges_near(lower, upper))
+    lower = np.concatenate((lower, a_lower, b_lower)) - CONTACT_WINDOW
+    upper = np.concatenate((upper, a_upper, b_upper)) + CONTACT_WINDOW
+    a_edges = a.edges_near(lower, upper)
+    b_edges = b.edges_near(lower, upper)
+    if not len(a_edges) or not len(b_edges):
+        return None
+    return precision_aware_intersection(a.edge_lines(a_edges), b.edge_lines(b_edges))
+
+
+def expected_contacts(intersection, translation: tuple, new_contacts: list) -> np.ndarray:
+    # where A and B can touch after B moved by translation: the old contacts (staying with A or moving with B) and the new ones
+    segments = []
+    for geom in getattr(intersection, "geoms", [intersection]):
+        coords = np.asarray(geom.coords, dtype=float)
+        for start, end in zip(coords, coords[1:]) if len(coords) > 1 else [(coords[0], coords[0])]:
+            segments.append((start, end + translation))  # covers both positions and everything swept in between
+            segments.append((start + translation, end))
+    segments.extend((contact, contact) for contact in new_contacts)
+    return np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+
+
+if __name__ == '__main__':
+    # a repeated vertex, as it comes out of the SVG sampling sometimes, must not leave a zero-length edge behind
+    orbit = OrbitPolygon.from_polygon(Polygon([(32, 33), (29, 33), (29, 33), (25, 31), (27, 29), (31, 26)]))
+    assert len(orbit.coords) == 5, orbit.coords
+    merged = OrbitPolygon(np.array([(0, 0), (4, 0), (4.003, 0.001), (4, 4)])).translated((0.001, 0))  # 4.001 and 4.004 snap to the same point
+    assert len(merged.coords) == 3 and len(merged.edge_starts) == 3, merged.coords
+    print(orbit.coords, merged.coords, sep="\n")
@@ -0,0 +1,56 @@
+import numpy as np
+
+from shapely.geometry import Polygon
+from shapely.affinity import affine_transform
+
+IDENTITY = (0, False)  # (rotation in degrees, mirrored): mirroring flips x first, then the piece is rotated around the origin
+GRAIN_ROTATIONS = (0, 180)  # rotations that keep a piece on its grain line
+
+
+def orientation_matrix(orientation: tuple) -> np.ndarray:
+    rotation, mirrored = orientation
+    angle = np.radians(rotation)
+    rotate = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    return rotate @ np.diag([-1.0, 1.0]) if mirrored else rotate
+
+
+def from_matrix(matrix: np.ndarray) -> tuple:
+    # a mirrored matrix has a negative determinant, flipping x back leaves the rotation
+    mirrored = bool(np.linalg.det(matrix) < 0)
+    rotate = matrix @ np.diag([-1.0, 1.0]) if mirrored else matrix
+    rotation = round(float(np.degrees(np.arctan2(rotate[1, 0], rotate[0, 0]))), 6) % 360
+    return (int(rotation) if rotation.is_integer() else rotation), mirrored
+
+
+def compose(first: tuple, then: tuple) -> tuple:
+    # the orientation that does first, then then
+    return from_matrix(orientation_matrix(then) @ orientation_matrix(first))
+
+
+def inverse(orientation: tuple) -> tuple:
+    return from_matrix(np.linalg.inv(orientation_matrix(orientation)))
+
+
+def orient_vertices(vertices: list, orientation: tuple, decimals: int = 2) -> list:
+    if orientation == IDENTITY or not vertices:
+        return list(vertices)
+    oriented = np.round(np.asarray(vertices, dtype=float) @ orientation_matrix(orientation).T, decimals) + 0.0  # no -0.0
+    return [(float(x), float(y)) for x, y in oriented]
+
+
+def orient_polygon(polygon: Polygon, orientation: tuple) -> Polygon:
+    # not rounded, NFPs get transformed back and forth with this
+    if orientation == IDENTITY:
+        return polygon
+    matrix = orientation_matrix(orientation)
+    return affine_transform(polygon, [matrix[0, 0], matrix[0, 1], matrix[1, 0], matrix[1, 1], 0, 0])
+
+
+def allowed_orientations(rotations: tuple = (0,), mirror: bool = False) -> list:
+    # every rotation, and every rotation of the mirrored piece if mirroring is allowed, unmirrored first
+    return [(rotation % 360, mirrored) for mirrored in ((False, True) if mirror else (False,)) for rotation in rotations]
+
+
+if __name__ == '__main__':
+    print(compose((90, False), (0, True)), inverse((90, True)), inverse((90, False)))
+    print(orient_vertices([(0, 0), (2, 0), (2, 1)], (180, True)))
@@ -0,0 +1,16 @@
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+EXECUTOR_KINDS = (None, "thread", "process")
+
+
+def make_executor(kind: str | None, max_workers: int = None, initializer=None, initargs: tuple = ()) -> Executor | None:
+    # threads are enough for the Minkowski engines (shapely releases the GIL), the orbit is pure python and wants processes
+    if kind not in EXECUTOR_KINDS:
+        raise ValueError(f"Unknown executor kind: {kind}, expected one of {EXECUTOR_KINDS}")
+    if kind is None:
+        return None
+    max_workers = max_workers or os.cpu_count()
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs)
@@ -0,0 +1,134 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import queue
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from dataclasses import dataclass, field, asdict
+
+from shapely.geometry import Polygon
+
+from nester import marker_stats, load_pattern, add_nesting_arguments, nester_options
+from genetic import init_worker, evaluate
+from orientation import IDENTITY
+
+
+def bbox_size(piece) -> tuple:
+    min_x, min_y, max_x, max_y = Polygon(piece.vertices).bounds
+    return max_x - min_x, max_y - min_y
+
+
+# name -> sort key, every ordering places the biggest values first (ties keep the input order)
+ORDERINGS = {
+    "area": lambda piece: piece.area(),
+    "length": lambda piece: bbox_size(piece)[0],
+    "width": lambda piece: bbox_size(piece)[1],
+    "bbox_area": lambda piece: bbox_size(piece)[0] * bbox_size(piece)[1],
+    "perimeter": lambda piece: Polygon(piece.vertices).length,
+}
+
+
+@dataclass
+class PortfolioResult:
+    ordering: str | None  # name of the winning ordering
+    used_length: float
+    placements: list
+    finished: dict = field(default_factory=dict)  # ordering -> used length, for everything that finished in time
+    cancelled: list = field(default_factory=list)  # orderings that didn't finish before the deadline
+
+
+def ordered_positions(pieces: list, ordering: str) -> tuple:
+    if ordering not in ORDERINGS:
+        raise ValueError(f"Unknown ordering: {ordering}, expected one of {tuple(ORDERINGS)}")
+    key = ORDERINGS[ordering]
+    return tuple(sorted(range(len(pieces)), key=lambda position: key(pieces[position]), reverse=True))
+
+
+def race_orderings(pieces: list, nester_options: dict = None, orderings: tuple = tuple(ORDERINGS), deadline: float = None,
+                   workers: int = None, store_path: str = None) -> PortfolioResult:
+    """
+    Nests the pieces once per ordering, all orderings at the same time in a worker pool.
+    - returns the shortest marker that finished within deadline seconds, the workers still running are killed
+    - without a deadline it waits for every ordering
+    - orderings that come out the same are only nested once
+    - the workers share NFPs through an NfpStore, like in the genetic search
+    """
+    nester_options = nester_options or {}
+    pieces_data = [(piece.index, piece.name, list(piece.vertices)) for piece in pieces]
+    unturned = (IDENTITY,) * len(pieces)
+    end_time = time.monotonic() + deadline if deadline is not None else math.inf
+
+    orders = {}  # piece order -> orderings producing it
+    for ordering in orderings:
+        orders.setdefault(ordered_positions(pieces, ordering), []).append(ordering)
+
+    results = queue.Queue()
+    result = PortfolioResult(None, math.inf, [])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = store_path or os.path.join(temp_dir, "nfp_store.bin")
+        pool = multiprocessing.Pool(workers or min(len(orders), os.cpu_count()), init_worker, (pieces_data, nester_options, store_path))
+        try:
+            for order, names in orders.items():
+                pool.apply_async(evaluate, (order, unturned),
+                                 callback=lambda value, names=names: results.put((names, value)),
+                                 error_callback=lambda error, names=names: results.put((names, (math.inf, []))))
+
+            pending = set(ordering for names in orders.values() for ordering in names)
+            while pending:
+                try:
+                    names, (used_length, placements) = results.get(timeout=max(end_time - time.monotonic(), 0) if deadline is not None else None)
+                except queue.Empty:
+                    break
+                for name in names:
+                    pending.discard(name)
+                    result.finished[name] = used_length
+                if used_length < result.used_length:
+                    result.ordering, result.used_length, result.placements = names[0], used_length, placements
+        finally:
+            pool.terminate()  # the predictable latency is the point, so don't wait for slow orderings
+            pool.join()
+    result.cancelled = [ordering for ordering in orderings if ordering not in result.finished]
+    return result
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Race several deterministic piece orderings and keep the shortest marker.")
+    parser.add_argument("svg_file")
+    add_nesting_arguments(parser)
+    parser.add_argument("--orderings", nargs="+", choices=tuple(ORDERINGS), default=list(ORDERINGS))
+    parser.add_argument("--deadline", type=float, default=None, help="seconds, orderings still running then are cancelled")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--store", help="NFP store shared by the workers, kept afterwards (default: a temporary one)")
+    parser.add_argument("--output", help="write the best placements to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern = load_pattern(args.svg_file, merge_pieces=not args.no_merge)
+    options = nester_options(args, pattern)
+    start = time.perf_counter()
+    result = race_orderings(pattern.pieces, options, tuple(args.orderings), args.deadline, args.workers, args.store)
+
+    print(f"finished: {result.finished}, cancelled: {result.cancelled} ({time.perf_counter() - start:.1f}s)")
+    if not result.placements:
+        print("No ordering fit on the fabric in time")
+        return 1
+    print(f"best ordering: {result.ordering}")
+    for placement in result.placements:
+        print(f"{placement.name}: translated by ({placement.translation[0]:.2f}, {placement.translation[1]:.2f})")
+    print(marker_stats(result.placements, options["fabric_vertices"]))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump([asdict(placement) for placement in result.placements], output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import io
+import sys
+import json
+import math
+import time
+import argparse
+import contextlib
+from dataclasses import asdict
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+
+from models.piece import Piece
+from nester import Placement, FABRIC_VERTICES, NoFeasiblePosition, marker_stats, load_pattern, fabric_rectangle, translate_piece
+from feasible_region import shape_key
+
+RASTER_RESOLUTION = 2  # cells per cm
+CELL_MARGIN = 1e-6  # cm, an edge lying exactly on a grid line doesn't occupy the cell on its other side
+
+
+def cell_boxes(origin: tuple, shape: tuple, resolution: float, margin: float = 0) -> np.ndarray:
+    # boxes of a grid indexed [x, y], cell (0, 0) has its lower left corner at origin
+    cell_size = 1 / resolution
+    xs = origin[0] + np.arange(shape[0]) * cell_size
+    ys = origin[1] + np.arange(shape[1]) * cell_size
+    x_min, y_min = np.meshgrid(xs, ys, indexing="ij")
+    return shapely.box(x_min + margin, y_min + margin, x_min + cell_size - margin, y_min + cell_size - margin)
+
+
+def rasterize_piece(vertices: list, resolution: float = RASTER_RESOLUTION) -> np.ndarray:
+    # conservative: every cell the piece reaches into is occupied, so pieces on disjoint cells never overlap
+    polygon = Polygon(vertices)
+    min_x, min_y, max_x, max_y = polygon.bounds
+    shape = (max(math.ceil((max_x - min_x) * resolution - 1e-9), 1), max(math.ceil((max_y - min_y) * resolution - 1e-9), 1))
+    return shapely.intersects(polygon, cell_boxes((min_x, min_y), shape, resolution, CELL_MARGIN)).astype(float)
+
+
+def rasterize_fabric(fabric_vertices: list, resolution: float = RASTER_RESOLUTION) -> np.ndarray:
+    # cells that aren't completely on the fabric count as occupied
+    fabric = Polygon(fabric_vertices)
+    min_x, min_y, max_x, max_y = fabric.bounds
+    shape = (int((max_x - min_x) * resolution + 1e-9), int((max_y - min_y) * resolution + 1e-9))
+    return (~shapely.covers(fabric, cell_boxes((min_x, min_y), shape, resolution))).astype(float)
+
+
+class RasterNester():
+    """
+    Discrete alternative to Nester: fabric and pieces become occupancy grids, collisions are found by FFT cross-correlation.
+    - a piece can go wherever the correlation of its grid with the occupancy is zero, bottom-left is the first such cell
+    - runtime depends on the fabric area and the resolution, not on the number of vertices
+    - layouts are valid (pieces are rasterized conservatively), but up to a cell per piece side is wasted
+    Same Piece input and Placement output as Nester, stripes aren't supported.
+    """
+    def __init__(self, fabric_vertices: list = FABRIC_VERTICES, resolution: float = RASTER_RESOLUTION):
+        self.fabric_vertices = fabric_vertices
+        self.resolution = resolution
+        self.origin = np.array(Polygon(fabric_vertices).bounds[:2])
+        self.occupancy = rasterize_fabric(fabric_vertices, resolution)
+        self.piece_spectra = {}  # shape key -> (piece grid, its spectrum at the fabric's grid size)
+        self.placed_pieces = []
+        self.placements = []
+
+    def piece_spectrum(self, piece: Piece) -> tuple:
+        key = shape_key(Polygon(piece.vertices))
+        if key not in self.piece_spectra:
+            grid = rasterize_piece(piece.vertices, self.resolution)
+            self.piece_spectra[key] = (grid, np.conj(np.fft.rfft2(grid, s=self.occupancy.shape)))
+        return self.piece_spectra[key]
+
+    def valid_positions(self, piece: Piece) -> tuple:
+        # -> (piece grid, mask of the cells its lower left grid corner can go to without hitting anything)
+        grid, spectrum = self.piece_spectrum(piece)
+        free_x, free_y = self.occupancy.shape[0] - grid.shape[0] + 1, self.occupancy.shape[1] - grid.shape[1] + 1
+        if free_x <= 0 or free_y <= 0:
+            return grid, np.zeros((0, 0), dtype=bool)
+        # circular correlation, but the positions kept here never wrap around
+        overlap = np.fft.irfft2(np.fft.rfft2(self.occupancy) * spectrum, s=self.occupancy.shape)[:free_x, :free_y]
+        return grid, overlap < 0.5
+
+    def place(self, piece: Piece) -> tuple:
+        grid, valid = self.valid_positions(piece)
+        cells = np.argwhere(valid)  # in x, then y order, so the first one is the leftest lowest
+        if len(cells) == 0:
+            raise NoFeasiblePosition("No feasible position left on the fabric")
+        cell_x, cell_y = int(cells[0][0]), int(cells[0][1])
+        self.occupancy[cell_x:cell_x + grid.shape[0], cell_y:cell_y + grid.shape[1]] += grid
+
+        min_x, min_y, _, _ = Polygon(piece.vertices).bounds
+        translation = (round(self.origin[0] + cell_x / self.resolution - min_x, 2), round(self.origin[1] + cell_y / self.resolution - min_y, 2))
+        translate_piece(piece, translation)
+        self.placed_pieces.append(piece)
+        return translation
+
+    def restore(self, placements: list) -> None:
+        # takes over pieces placed elsewhere (e.g. by Nester), every cell they reach into is occupied
+        for placement in placements:
+            polygon = Polygon(placement.vertices)
+            min_x, min_y, max_x, max_y = polygon.bounds
+            lower = np.clip(np.floor((np.array([min_x, min_y]) - self.origin) * self.resolution).astype(int), 0, self.occupancy.shape)
+            upper = np.clip(np.ceil((np.array([max_x, max_y]) - self.origin) * self.resolution).astype(int), 0, self.occupancy.shape)
+            if np.any(upper <= lower):
+                continue  # not on the fabric's grid at all
+            cells = shapely.intersects(polygon, cell_boxes(tuple(self.origin + lower / self.resolution), tuple(upper - lower), self.resolution, CELL_MARGIN))
+            self.occupancy[lower[0]:upper[0], lower[1]:upper[1]] += cells
+            self.placed_pieces.append(Piece.from_vertices(placement.index, placement.name, placement.vertices))
+            self.placements.append(placement)
+
+    def fit_all(self, pieces: list) -> list:
+        placements = []
+        for piece in pieces:
+            translation = self.place(piece)
+            placements.append(Placement(piece.index, piece.name, translation, list(piece.vertices), *piece.orientation))
+        self.placements.extend(placements)
+        return placements
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Quick raster nesting of an SVG pattern (FFT collision test instead of NFPs).")
+    parser.add_argument("svg_file")
+    parser.add_argument("--fabric-length", type=float, default=200, help="fabric size along x (cm)")
+    parser.add_argument("--fabric-width", type=float, default=150, help="fabric size along y (cm)")
+    parser.add_argument("--resolution", type=float, default=RASTER_RESOLUTION, help="grid cells per cm")
+    parser.add_argument("--no-merge", action="store_true", help="don't merge pieces that share a seam line")
+    parser.add_argument("--output", help="write the placements to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern = load_pattern(args.svg_file, merge_pieces=not args.no_merge)
+    nester = RasterNester(fabric_rectangle(args.fabric_length, args.fabric_width), args.resolution)
+    start = time.perf_counter()
+    placements = nester.fit_all(pattern.pieces)
+
+    print(f"nested in {time.perf_counter() - start:.2f}s on a {nester.occupancy.shape[0]}x{nester.occupancy.shape[1]} grid")
+    for placement in placements:
+        print(f"{placement.name}: translated by ({placement.translation[0]:.2f}, {placement.translation[1]:.2f})")
+    print(marker_stats(placements, nester.fabric_vertices))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump([asdict(placement) for placement in placements], output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
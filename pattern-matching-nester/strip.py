@@ -0,0 +1,132 @@
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+from dataclasses import dataclass, field, asdict
+
+from shapely.geometry import Polygon
+
+from models.piece import Piece
+from nester import Nester, NoFeasiblePosition, marker_stats, load_pattern, fabric_rectangle, add_nesting_arguments, nester_options
+
+LENGTH_TOLERANCE = 1.0  # cm, bisection stops once the bracket is this narrow
+
+
+@dataclass
+class StripResult:
+    length: float  # shortest fabric length a layout was found for (= its used length)
+    lower_bound: float
+    placements: list
+    iterations: int = 0
+    history: list = field(default_factory=list)  # (tried length, used length or None if nothing fit)
+
+
+def length_lower_bound(pieces: list, width: float) -> float:
+    # no marker is shorter than the pieces' area spread over the whole width, or than the longest piece
+    area_bound = sum(piece.area() for piece in pieces) / width
+    longest_piece = max(Polygon(piece.vertices).bounds[2] - Polygon(piece.vertices).bounds[0] for piece in pieces)
+    return max(area_bound, longest_piece)
+
+
+def nest_on_length(pieces: list, length: float, width: float, nester_options: dict, warm_start: list = None) -> list | None:
+    """
+    Nests copies of the pieces on a fabric of the given length, returns the placements or None if they don't fit.
+    - warm_start: placements of a longer feasible layout, the leading ones that still fit on this length are kept as they are
+      and only the rest gets placed again
+    - if the warm-started layout doesn't fit, the pieces are nested from scratch once more
+    """
+    fabric_vertices = fabric_rectangle(length, width)
+    kept = []
+    for placement in warm_start or []:
+        if max(x for x, _ in placement.vertices) > length:
+            break
+        kept.append(placement)
+
+    attempts = [kept, []] if kept else [[]]
+    for kept_placements in attempts:
+        nester = Nester(fabric_vertices, **nester_options)
+        nester.restore(kept_placements)
+        kept_indices = set(placement.index for placement in kept_placements)
+        remaining = [Piece.from_vertices(piece.index, piece.name, piece.vertices) for piece in pieces if piece.index not in kept_indices]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return list(kept_placements) + nester.fit_all(remaining)
+        except NoFeasiblePosition:
+            continue  # anything else is a bug, not a length that is too short
+    return None
+
+
+def minimize_length(pieces: list, width: float, nester_options: dict = None, max_length: float = None,
+                    tolerance: float = LENGTH_TOLERANCE, max_iterations: int = 20) -> StripResult:
+    """
+    Strip packing: the roll width is fixed, bisects on the fabric length for the shortest marker.
+    - every feasible layout tightens the upper bound to its used length, not just to the length that was tried
+    - iterations share the NFP cache (NFPs don't depend on the fabric) and start from the last feasible layout
+    - stops once the bracket is within tolerance, which includes reaching the area lower bound
+    max_length defaults to all pieces in one row, which always fits as long as every piece fits across the width.
+    """
+    nester_options = nester_options or {}
+    for piece in pieces:
+        _, min_y, _, max_y = Polygon(piece.vertices).bounds
+        if max_y - min_y > width:
+            raise ValueError(f"Piece {piece.name} doesn't fit across a fabric width of {width}")
+
+    lower_bound = length_lower_bound(pieces, width)
+    if max_length is None:
+        max_length = sum(Polygon(piece.vertices).bounds[2] - Polygon(piece.vertices).bounds[0] for piece in pieces)
+
+    placements = nest_on_length(pieces, max_length, width, nester_options)
+    if placements is None:
+        raise ValueError(f"The pieces don't fit on a fabric of length {max_length}")
+    result = StripResult(marker_stats(placements, fabric_rectangle(max_length, width))["used_length"], lower_bound, placements, 1)
+    result.history.append((max_length, result.length))
+
+    low = lower_bound
+    while result.length - low > tolerance and result.iterations < max_iterations:
+        length = round((low + result.length) / 2, 2)
+        placements = nest_on_length(pieces, length, width, nester_options, warm_start=result.placements)
+        result.iterations += 1
+        if placements is None:
+            low = length
+            result.history.append((length, None))
+            continue
+        used_length = marker_stats(placements, fabric_rectangle(length, width))["used_length"]
+        result.history.append((length, used_length))
+        result.length, result.placements = used_length, placements
+    return result
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Find the shortest fabric length the pattern fits on, for a fixed roll width.")
+    parser.add_argument("svg_file")
+    add_nesting_arguments(parser)  # --fabric-length is the longest fabric tried
+    parser.add_argument("--tolerance", type=float, default=LENGTH_TOLERANCE)
+    parser.add_argument("--max-iterations", type=int, default=20)
+    parser.add_argument("--output", help="write the placements of the shortest marker to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> int:
+    args = parse_args(argv)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pattern = load_pattern(args.svg_file, merge_pieces=not args.no_merge)
+    options = nester_options(args, pattern)
+    del options["fabric_vertices"]  # the length gets bisected
+    start = time.perf_counter()
+    result = minimize_length(pattern.pieces, args.fabric_width, options, args.fabric_length, args.tolerance, args.max_iterations)
+
+    print(f"{result.iterations} iterations ({time.perf_counter() - start:.1f}s): {result.history}")
+    print(f"shortest length: {result.length}, lower bound: {result.lower_bound:.2f}")
+    for placement in result.placements:
+        print(f"{placement.name}: translated by ({placement.translation[0]:.2f}, {placement.translation[1]:.2f})")
+    print(marker_stats(result.placements, fabric_rectangle(result.length, args.fabric_width)))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump([asdict(placement) for placement in result.placements], output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import math
+from collections import deque
+
+import numpy as np
+
+import shapely
+from shapely.geometry import Polygon
+
+from svg_helper import to_svg
+from helper import nfp_reference_point
+
+STRIPE_SPACING = 10
+PHASE_TOLERANCE = 0.05  # cm, seams whose stripe phases differ by less than this still count as matched
+
+
+def region_edges(region) -> tuple:
+    # -> (starts, ends) of every ring edge of a (multi)polygon or a collection that contains polygons, as (n, 2) arrays
+    parts = shapely.get_parts(shapely.get_parts(region))  # collections can hold multipolygons
+    polygons = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON] if len(parts) else parts
+    rings = shapely.get_rings(polygons) if len(polygons) else polygons
+    if len(rings) == 0:
+        return np.empty((0, 2)), np.empty((0, 2))
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+    same_ring = ring_index[:-1] == ring_index[1:]  # rings are closed, so this skips exactly the jumps between rings
+    return coords[:-1][same_ring], coords[1:][same_ring]
+
+
+def stripe_rows(y_min: float, y_max: float, stripe_spacing: int = STRIPE_SPACING) -> np.ndarray:
+    return np.arange(int(y_min), int(y_max) + 1, stripe_spacing, dtype=float)
+
+
+def stripe_intervals(region, stripe_spacing: int = STRIPE_SPACING, rows: np.ndarray = None) -> tuple:
+    """
+    Scanline version of intersecting every stripe row with the region: all rows against all edges in one numpy pass.
+    - returns (ys, starts, ends), one entry per x-interval of a row that lies in the region (borders included)
+    - the rows default to every stripe_spacing from the region's (truncated) lowest y, like the shapely version did
+    - single touching points are left out, shapely returned them as points and they never became candidates
+    """
+    starts, ends = region_edges(region)
+    if len(starts) == 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    if rows is None:
+        rows = stripe_rows(min(starts[:, 1].min(), ends[:, 1].min()), max(starts[:, 1].max(), ends[:, 1].max()), stripe_spacing)
+    x0, y0, x1, y1 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+    ys = rows[:, None]
+
+    # crossings of the non-horizontal edges, half-open in y so that a vertex on a row is only counted once
+    low, high = np.minimum(y0, y1), np.maximum(y0, y1)
+    crossing = (low <= ys) & (ys < high)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xs = np.where(crossing, x0 + (ys - y0) * (x1 - x0) / (y1 - y0), np.inf)
+    grid_size = shapely.get_precision(region)
+    if grid_size > 0:  # shapely snaps the intersections of a region with a precision to its grid, so do the same
+        xs = np.round(xs / grid_size) * grid_size
+    xs.sort(axis=1)
+    count = crossing.sum(axis=1)
+    pair_index = np.arange(xs.shape[1] // 2)
+    inside = pair_index[None, :] < (count // 2)[:, None]  # (rows, pairs): inside the region between crossing 2k and 2k+1
+    row_index, pair = np.nonzero(inside)
+    interval_ys = rows[row_index]
+    interval_starts = xs[row_index, 2 * pair]
+    interval_ends = xs[row_index, 2 * pair + 1]
+
+    # horizontal edges that lie on a row are part of the region (its border) as well
+    horizontal = (y0 == y1)
+    on_row = (np.abs(ys - y0[horizontal]) <= 1e-9).any(axis=0)  # rows can be off by rounding when they come with a phase
+    edge_ys = y0[horizontal][on_row]
+    edge_starts = np.minimum(x0, x1)[horizontal][on_row]
+    edge_ends = np.maximum(x0, x1)[horizontal][on_row]
+
+    ys = np.concatenate([interval_ys, edge_ys])
+    starts = np.concatenate([interval_starts, edge_starts])
+    ends = np.concatenate([interval_ends, edge_ends])
+    keep = ends > starts
+    return ys[keep], starts[keep], ends[keep]
+
+
+def bottom_left_on_stripes(region, stripe_spacing: int = STRIPE_SPACING, rows: np.ndarray = None) -> tuple | None:
+    # the leftest (then lowest) point on a stripe, None if no stripe runs through the region
+    ys, starts, _ = stripe_intervals(region, stripe_spacing, rows)
+    if len(ys) == 0:
+        return None
+    best = np.lexsort((ys, starts))[0]
+    return float(starts[best]), float(ys[best])
+
+
+def phase_rows(y_min: float, y_max: float, phase: float, stripe_spacing: int = STRIPE_SPACING, origin: float = 0) -> np.ndarray:
+    # the rows origin + phase + k * stripe_spacing between y_min and y_max
+    first = origin + phase + math.ceil((y_min - origin - phase) / stripe_spacing - 1e-9) * stripe_spacing
+    return np.round(np.arange(first, y_max + 1e-9, stripe_spacing), 2)
+
+
+def seam_point(pattern, part: str, local_point: tuple) -> tuple:
+    # seam coordinates -> the pattern's piece coordinates (y up, scaled)
+    z = to_svg(pattern.part_frames[part], complex(*local_point))
+    return z.real * pattern.unit_scale, -z.imag * pattern.unit_scale
+
+
+def seam_links(pattern) -> list:
+    """
+    The seams between different pieces as (piece a, piece b, offset, seam id), with offset the (x, y) vector
+    (reference point of b - its seam point) - (reference point of a - its seam point).
+    The two sides of a seam are sewn start to end, so the start of one seampart meets the end of the other.
+    A repeating fabric continues across the seam if both reference points sit at the same phase plus their offset.
+    """
+    piece_of_part = {part: piece for piece in pattern.pieces for part in piece.name.split("+")}
+    reference_points = {piece.index: nfp_reference_point(piece.vertices) for piece in pattern.pieces}
+
+    links = []
+    for seam in pattern.seams:
+        if len(seam.seamparts) != 2:
+            continue
+        part_a, part_b = seam.seamparts
+        if any(part.part not in piece_of_part or part.part not in pattern.part_frames for part in seam.seamparts):
+            continue
+        piece_a, piece_b = piece_of_part[part_a.part].index, piece_of_part[part_b.part].index
+        if piece_a == piece_b:
+            continue
+        (x_a, y_a), (x_b, y_b) = seam_point(pattern, part_a.part, part_a.start), seam_point(pattern, part_b.part, part_b.end)
+        (ref_x_a, ref_y_a), (ref_x_b, ref_y_b) = reference_points[piece_a], reference_points[piece_b]
+        links.append((piece_a, piece_b, ((ref_x_b - x_b) - (ref_x_a - x_a), (ref_y_b - y_b) - (ref_y_a - y_a)), seam.id))
+    return links
+
+
+def propagate_phases(pattern, links: list, zero, add, mismatch) -> tuple:
+    # breadth first through the seam graph, the first (biggest) piece of every group gets phase zero
+    # add(phase, offset, sign) -> phase of the neighbour, mismatch(phase, phase) -> whether the seam can't be matched
+    neighbours = {}
+    for piece_a, piece_b, offset, seam_id in links:
+        neighbours.setdefault(piece_a, []).append((piece_b, offset, 1, seam_id))
+        neighbours.setdefault(piece_b, []).append((piece_a, offset, -1, seam_id))
+
+    phases = {}
+    conflicts = []
+    for piece in pattern.pieces:
+        if piece.index in phases or piece.index not in neighbours:
+            continue
+        phases[piece.index] = zero
+        queue = deque([piece.index])
+        while queue:
+            current = queue.popleft()
+            for other, offset, sign, seam_id in neighbours[current]:
+                phase = add(phases[current], offset, sign)
+                if other not in phases:
+                    phases[other] = phase
+                    queue.append(other)
+                elif mismatch(phases[other], phase) and seam_id not in conflicts:
+                    conflicts.append(seam_id)
+    return phases, conflicts
+
+
+def seam_stripe_phases(pattern, stripe_spacing: int = STRIPE_SPACING, tolerance: float = PHASE_TOLERANCE) -> tuple:
+    """
+    Per piece, where its reference point has to sit in y, modulo stripe_spacing, for the stripes to continue across its seams.
+    - pieces connected by seams get phases relative to each other, the first (biggest) piece of every group sits on a stripe
+    - seams within one piece, and pieces without seams to others, don't constrain anything (no phase for them)
+    Returns (piece index -> phase in [0, stripe_spacing), ids of the seams that can't be matched because of a cycle).
+    """
+    def add(phase: float, offset: tuple, sign: int) -> float:
+        return round((phase + sign * offset[1]) % stripe_spacing, 2) % stripe_spacing
+
+    def mismatch(phase: float, other_phase: float) -> bool:
+        difference = abs(phase - other_phase)
+        return min(difference, stripe_spacing - difference) > tolerance
+
+    return propagate_phases(pattern, seam_links(pattern), 0.0, add, mismatch)
+
+
+def stripe_lines(ys: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> list:
+    # intervals -> LineStrings, only needed for drawing
+    coords = np.stack([np.stack([starts, ys], axis=1), np.stack([ends, ys], axis=1)], axis=1)
+    return list(shapely.linestrings(coords)) if len(coords) else []
+
+
+if __name__ == '__main__':
+    region = Polygon([(0, 0), (50, 0), (50, 35), (0, 35)], [[(10, 10), (20, 10), (20, 25), (10, 25)]])
+    print(stripe_intervals(region, 10))
+    print(bottom_left_on_stripes(region, 10))
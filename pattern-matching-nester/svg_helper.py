@@ -1,12 +1,17 @@
 import re
 import math
 from dataclasses import dataclass
-from svgpathtools import Path, parse_path
+from svgpathtools import Path, Line, parse_path
+from shapely.geometry import LineString, Point
 import lxml.etree as ETree
 import xml.etree.ElementTree as ET
 
 from models.piece import Piece
-from demo import ALLOWED_CLASS_LISTS, MERGE_SLEEVES
+
+# seam metadata points lie exactly on their part's outline once the right frame is found (below 1e-4 on the turtleneck),
+# the closest wrong candidate frame there is 0.59 off, so this leaves room for rounding on either side
+FRAME_TOLERANCE = 0.05  # svg units
+OUTLINE_SPACING = 0.1  # svg units between samples of curved segments, lines are taken as they are
 
 
 # seam information dataclasses
@@ -157,7 +162,7 @@ def get_svg_attributes(svg_file: str) -> dict:
     }
 
 
-def load_selected_paths(svg_file: str) -> list:
+def load_selected_paths(svg_file: str, allowed_class_lists: list = None, merge_sleeves: bool = True) -> list:
     tree = ETree.parse(svg_file)
     root = tree.getroot()
     selected_paths = []
@@ -171,7 +176,7 @@ def load_selected_paths(svg_file: str) -> list:
             continue
 
         class_list = elem.attrib.get('class', '').split()
-        if ALLOWED_CLASS_LISTS and class_list not in ALLOWED_CLASS_LISTS:
+        if allowed_class_lists and class_list not in allowed_class_lists:
             continue
 
         path = parse_path(path_data)
@@ -185,8 +190,8 @@ def load_selected_paths(svg_file: str) -> list:
             current_elem = current_elem.getparent()
 
         # sort out sleeves to merge them (if needed)
-        if MERGE_SLEEVES:
-            name_attr = elem.attrib.get('name')
+        name_attr = elem.attrib.get('name')
+        if merge_sleeves:
             if name_attr and 'sleeve' in name_attr.lower():
                 sleeve_paths.append((name_attr.lower(), path_data))
                 continue
@@ -200,6 +205,71 @@ def load_selected_paths(svg_file: str) -> list:
 
 
 
+def part_frames(paths: list, seams: list, tolerance: float = FRAME_TOLERANCE) -> dict:
+    """
+    Where the local coordinates of the seam metadata are, per part: name -> (rotation, offset, mirrored), complex, svg units
+    - usually they are relative to the top left corner of the part's bbox (y pointing down)
+    - sleeves are rotated for merging and come with their own frame, for them the seam end points get matched
+      to the corners of the loaded path
+    A local seam point p is at rotation * (p or its conjugate if mirrored) + offset. Parts without a frame that puts
+    all their seam points onto their outline (within tolerance) are left out.
+    The frames are needed because the seam metadata only has local coordinates, see stripes.seam_point.
+    """
+    seam_points = {}
+    for seam in seams:
+        for seampart in seam.seamparts:
+            seam_points.setdefault(seampart.part, set()).update([complex(*seampart.start), complex(*seampart.end)])
+
+    frames = {}
+    for name, path in paths:
+        if name not in seam_points:
+            continue
+        if isinstance(path, str):
+            path = parse_path(path)
+        points = list(seam_points[name])
+        corners = [seg.start for seg in path]
+        x_min, _, y_min, _ = path.bbox()
+        candidates = [(1 + 0j, complex(x_min, y_min), False)] + __corner_frames(points, corners, tolerance)
+        outline = __outline(path)
+        for frame in candidates:
+            if all(outline.distance(Point(to_svg(frame, point).real, to_svg(frame, point).imag)) <= tolerance for point in points):
+                frames[name] = frame
+                break
+    return frames
+
+
+def to_svg(frame: tuple, point: complex) -> complex:
+    rotation, offset, mirrored = frame
+    return rotation * (point.conjugate() if mirrored else point) + offset
+
+
+def __corner_frames(points: list, corners: list, tolerance: float) -> list:
+    # rigid motions (with and without mirroring) that put the two seam points furthest apart onto two corners
+    if len(points) < 2:
+        return []
+    p, q = max(((a, b) for a in points for b in points), key=lambda pair: abs(pair[0] - pair[1]))
+    frames = []
+    for u in corners:
+        for v in corners:
+            if u == v or abs(abs(u - v) - abs(p - q)) > tolerance:
+                continue
+            for mirrored in (False, True):
+                p_m, q_m = (p.conjugate(), q.conjugate()) if mirrored else (p, q)
+                rotation = complex((v - u) / abs(v - u) / ((q_m - p_m) / abs(q_m - p_m)))
+                frames.append((rotation, complex(u - rotation * p_m), mirrored))
+    return frames
+
+
+def __outline(path: Path, spacing: float = OUTLINE_SPACING) -> LineString:
+    # the path as a polyline, so distances to it are exact along lines and off by the chord error on curves
+    points = []
+    for seg in path:
+        samples = 1 if isinstance(seg, Line) else max(math.ceil(seg.length(error=1e-4) / spacing), 1)
+        points.extend(seg.point(t / samples) for t in range(samples))
+    points.append(path[-1].end)
+    return LineString([(point.real, point.imag) for point in points])
+
+
 def prepare_sleeve_paths_for_merge(path_tuples: list) -> list:
     if len(path_tuples) not in (2, 4):
         raise ValueError(f"Expected 2 or 4 sleeve paths, got {len(path_tuples)}")